@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+""" Bulk component selection access shared by the tools
+
+Components are read from the active selection list as int32 index arrays
+per dag path and component type. Nothing is flattened into per-component
+strings.
+"""
+
+import re
+
+from maya.api import OpenMaya
+from maya import cmds
+import numpy as np
+
+
+VERTEX = "vtx"
+EDGE = "e"
+FACE = "f"
+UV = "map"
+
+COMPONENT_TYPES = {
+    OpenMaya.MFn.kMeshVertComponent: VERTEX,
+    OpenMaya.MFn.kMeshEdgeComponent: EDGE,
+    OpenMaya.MFn.kMeshPolygonComponent: FACE,
+    OpenMaya.MFn.kMeshMapComponent: UV,
+}
+
+API_TYPES = dict((v, k) for k, v in COMPONENT_TYPES.items())
+
+CONVERSION_FLAGS = {
+    VERTEX: "toVertex",
+    EDGE: "toEdge",
+    FACE: "toFace",
+    UV: "toUV",
+}
+
+COMPONENT_RANGE = re.compile(r"^(.*)\.(\w+)\[(\d+)(?::(\d+))?\]$")
+
+
+class Components(object):
+    """ Selected components of one type on one object """
+
+    __slots__ = ("dagPath", "componentType", "indices")
+
+    def __init__(self, dagPath, componentType, indices):
+        # type: (OpenMaya.MDagPath, str, np.ndarray) -> None
+
+        self.dagPath = dagPath
+        self.componentType = componentType
+        self.indices = indices
+
+    def __repr__(self):
+        return "Components({}.{}, {} items)".format(
+            self.dagPath.fullPathName(), self.componentType, len(self.indices))
+
+
+def getElements(component):
+    # type: (OpenMaya.MObject) -> np.ndarray
+    """ Indices of a single indexed component as an int32 array """
+
+    elements = OpenMaya.MFnSingleIndexedComponent(component).getElements()
+    return np.fromiter(elements, dtype=np.int32, count=len(elements))
+
+
+def getSelectedComponents(componentType=None, selectionList=None):
+    # type: (str, OpenMaya.MSelectionList) -> list
+    """ Get selected components without flattening
+        Args:
+            componentType: only return this type, VERTEX, EDGE, FACE or UV
+            selectionList: defaults to the active selection list
+
+        Returns:
+            List of Components, one per dag path and component type
+    """
+
+    if selectionList is None:
+        selectionList = OpenMaya.MGlobal.getActiveSelectionList()
+
+    merged = {}
+    order = []
+
+    for i in range(selectionList.length()):
+        try:
+            dagPath, component = selectionList.getComponent(i)
+        except TypeError:
+            # Not a dag node
+            continue
+
+        if component.isNull():
+            continue
+
+        compType = COMPONENT_TYPES.get(component.apiType())
+        if compType is None:
+            continue
+        if componentType is not None and compType != componentType:
+            continue
+
+        key = (dagPath.fullPathName(), compType)
+        if key not in merged:
+            merged[key] = Components(dagPath, compType, [])
+            order.append(key)
+        merged[key].indices.append(getElements(component))
+
+    result = []
+    for key in order:
+        item = merged[key]
+        if len(item.indices) == 1:
+            item.indices = item.indices[0]
+        else:
+            item.indices = np.unique(np.concatenate(item.indices))
+        result.append(item)
+
+    return result
+
+
+def getSelectedObjects(selectionList=None):
+    # type: (OpenMaya.MSelectionList) -> list
+    """ Dag paths of selected objects, including objects of components
+        Args:
+            selectionList: defaults to the active selection list
+
+        Returns:
+            List of MDagPath, without duplicates
+    """
+
+    if selectionList is None:
+        selectionList = OpenMaya.MGlobal.getActiveSelectionList()
+
+    paths = []
+    names = set()
+
+    for i in range(selectionList.length()):
+        try:
+            dagPath = selectionList.getDagPath(i)
+        except TypeError:
+            continue
+
+        name = dagPath.fullPathName()
+        if name not in names:
+            names.add(name)
+            paths.append(dagPath)
+
+    return paths
+
+
+def hasComponents(selectionList=None):
+    # type: (OpenMaya.MSelectionList) -> bool
+    """ True if any component is selected """
+
+    return bool(getSelectedComponents(selectionList=selectionList))
+
+
+def convertSelection(componentType, selectionList=None):
+    # type: (str, OpenMaya.MSelectionList) -> OpenMaya.MSelectionList
+    """ Convert selected mesh components to one type, eg. faces to uvs
+        Components are converted as compact ranges, objects without
+        selected components are left out.
+
+        Args:
+            componentType: VERTEX, EDGE, FACE or UV
+            selectionList: defaults to the active selection list
+
+        Returns:
+            MSelectionList of the converted components
+    """
+
+    if selectionList is None:
+        selectionList = OpenMaya.MGlobal.getActiveSelectionList()
+
+    components = OpenMaya.MSelectionList()
+    for i in range(selectionList.length()):
+        try:
+            dagPath, component = selectionList.getComponent(i)
+        except TypeError:
+            # Not a dag node
+            continue
+
+        if component.apiType() in COMPONENT_TYPES:
+            components.add((dagPath, component))
+
+    converted = OpenMaya.MSelectionList()
+    if components.isEmpty():
+        return converted
+
+    paths = cmds.polyListComponentConversion(
+        components.getSelectionStrings(),
+        **{CONVERSION_FLAGS[componentType]: True}) or []
+    for path in paths:
+        converted.add(path)
+
+    return converted
+
+
+def setSelection(dagPath, componentType, indices, add=False):
+    # type: (OpenMaya.MDagPath, str, np.ndarray, bool) -> None
+    """ Select components from an index array
+        Args:
+            dagPath: object dag path
+            componentType: VERTEX, EDGE, FACE or UV
+            indices: component indices
+            add: add to the current selection instead of replacing it
+
+        Returns:
+            None
+    """
+
+    fnComponent = OpenMaya.MFnSingleIndexedComponent()
+    component = fnComponent.create(API_TYPES[componentType])
+    fnComponent.addElements(np.asarray(indices, dtype=np.int64).tolist())
+
+    if add:
+        selectionList = OpenMaya.MGlobal.getActiveSelectionList()
+    else:
+        selectionList = OpenMaya.MSelectionList()
+    selectionList.add((dagPath, component))
+
+    OpenMaya.MGlobal.setActiveSelectionList(selectionList)
+
+
+def parseComponentRanges(paths, componentType=UV, objects=None):
+    # type: (list, str, set) -> tuple
+    """ Parse component strings into index ranges without flattening
+        Args:
+            paths: components, eg. '|pCube1.map[10:200]'
+            componentType: only keep this component type
+            objects: only keep components of these object paths
+
+        Returns:
+            (start indices, inclusive end indices) as numpy arrays
+    """
+
+    starts = []
+    ends = []
+
+    for path in paths:
+        match = COMPONENT_RANGE.match(path)
+        if match is None:
+            continue
+
+        obj, compType, start, end = match.groups()
+        if compType != componentType:
+            continue
+        if objects is not None and obj not in objects:
+            continue
+
+        starts.append(int(start))
+        ends.append(int(end) if end is not None else int(start))
+
+    return (np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64))
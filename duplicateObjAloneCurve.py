@@ -1,17 +1,37 @@
-""" duplicate along curve """
+""" duplicate along curve
 
-import random
+Rivets are placed in two stages, all frames are computed first and then
+every rivet is created at once. Curves are evaluated with numpy from their
+cvs and knots, rivet params come from a cumulative arc-length table. The
+default instance mode builds one transform per rivet with an instance of
+the rivet children through a single MDagModifier, undoable as one step
+with apiundo. The duplicate mode keeps full copies with cmds.duplicate.
 
-from maya import OpenMaya
+Requirements: https://github.com/mottosso/apiundo
+"""
+
+from maya.api import OpenMaya
 from maya import OpenMayaUI
 from maya import cmds
-from PySide2 import QtWidgets, QtCore
-import shiboken2
+
+try:
+    from PySide6 import QtWidgets, QtCore
+    import shiboken6 as shiboken
+except ImportError:
+    from PySide2 import QtWidgets, QtCore
+    import shiboken2 as shiboken
+
+import apiundo
+import numpy as np
+
+
+INSTANCE_MODE = "instance"
+DUPLICATE_MODE = "duplicate"
 
 
 def getMayaWindow():
     ptr = OpenMayaUI.MQtUtil.mainWindow()
-    return shiboken2.wrapInstance(long(ptr), QtWidgets.QMainWindow)
+    return shiboken.wrapInstance(int(ptr), QtWidgets.QMainWindow)
 
 
 class GUI(QtWidgets.QWidget):
@@ -39,6 +59,8 @@ class GUI(QtWidgets.QWidget):
         self.rivetSetButton.clicked.connect(self.setRivet)
         self.intervalLE = QtWidgets.QLineEdit("0.2")
         self.randomLE = QtWidgets.QLineEdit("0.005")
+        self.modeCombo = QtWidgets.QComboBox()
+        self.modeCombo.addItems([INSTANCE_MODE, DUPLICATE_MODE])
         self.doButton = QtWidgets.QPushButton("Do it")
         self.doButton.clicked.connect(self.doIt)
 
@@ -53,6 +75,8 @@ class GUI(QtWidgets.QWidget):
         columnLayout.addWidget(self.intervalLE)
         columnLayout.addWidget(QtWidgets.QLabel("Randomness"))
         columnLayout.addWidget(self.randomLE)
+        columnLayout.addWidget(QtWidgets.QLabel("Mode"))
+        columnLayout.addWidget(self.modeCombo)
         columnLayout.addWidget(self.doButton)
 
         self.setLayout(columnLayout)
@@ -64,8 +88,9 @@ class GUI(QtWidgets.QWidget):
         rivet = self.rivetLE.text()
         interval = float(self.intervalLE.text())
         randomness = float(self.randomLE.text())
+        mode = self.modeCombo.currentText()
 
-        duplicateAloneCurves(surface, rivet, interval, randomness)
+        duplicateAloneCurves(surface, rivet, interval, randomness, mode)
 
     def setSurface(self):
         """ set snap target object """
@@ -80,87 +105,345 @@ class GUI(QtWidgets.QWidget):
         self.rivetLE.setText(sel)
 
 
-def duplicateAloneCurves(surface, rivet, interval, randomness):
-    """ duplicate alone curve """
+def getDagPath(path):
+    # type: (str) -> OpenMaya.MDagPath
+    sel = OpenMaya.MSelectionList()
+    sel.add(path)
+    return sel.getDagPath(0)
 
-    cmds.undoInfo(openChunk=True)
 
-    sel = OpenMaya.MSelectionList()
-    OpenMaya.MGlobal.getActiveSelectionList(sel)
-    numSelected = sel.length()
+def getCurveData(curvePath):
+    # type: (OpenMaya.MDagPath) -> tuple
+    """ Curve as numpy arrays for evaluateCurve
+        Args:
+            curvePath: curve dag path
+
+        Returns:
+            ((N, 4) homogeneous world space cvs, full knot vector, degree,
+             (start, end) param domain)
+    """
 
-    dagPath = OpenMaya.MDagPath()
+    fnCurve = OpenMaya.MFnNurbsCurve(curvePath)
+    cvs = np.array(
+        [(p.x * p.w, p.y * p.w, p.z * p.w, p.w)
+         for p in fnCurve.cvPositions(OpenMaya.MSpace.kWorld)])
+
+    # Maya leaves out the first and last knot, they never affect the curve
+    knots = np.array(fnCurve.knots(), dtype=np.float64)
+    knots = np.concatenate(([knots[0]], knots, [knots[-1]]))
 
-    # Setup snap target surface
-    surfaceDagPath = OpenMaya.MDagPath()
-    surfaceSelection = OpenMaya.MSelectionList()
-    surfaceSelection.add(surface)
-    surfaceSelection.getDagPath(0, surfaceDagPath)
-    surfaceFnMesh = OpenMaya.MFnMesh(surfaceDagPath)
+    return cvs, knots, fnCurve.degree, fnCurve.knotDomain
+
+
+def evaluateCurve(cvs, knots, degree, params):
+    # type: (np.ndarray, np.ndarray, int, np.ndarray) -> np.ndarray
+    """ Points on a nurbs curve at many params at once, de Boor
+        Args:
+            cvs: (N, 4) homogeneous cvs
+            knots: full knot vector, N + degree + 1 values
+            degree: curve degree
+            params: (M,) params in the knot domain
+
+        Returns:
+            (M, 3) points
+    """
+
+    numCVs = len(cvs)
+    spans = np.searchsorted(knots, params, side="right") - 1
+    spans = np.clip(spans, degree, numCVs - 1)
+
+    # (M, degree + 1, 4) cvs affecting each param
+    d = cvs[spans[:, None] - degree + np.arange(degree + 1)[None, :]]
+
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            left = knots[spans - degree + j]
+            right = knots[spans + 1 + j - r]
+            span = right - left
+            alpha = np.divide(
+                params - left, span,
+                out=np.zeros_like(params), where=span != 0)[:, None]
+            d[:, j] = (1.0 - alpha) * d[:, j - 1] + alpha * d[:, j]
+
+    points = d[:, degree]
+    return points[:, :3] / points[:, 3:]
+
+
+def sampleCurve(curvePath, interval, samplesPerSpan=64):
+    # type: (OpenMaya.MDagPath, float, int) -> tuple
+    """ Evenly spaced points along a curve
+        The curve is sampled densely once into a cumulative arc-length
+        table, params at every interval are interpolated from it.
+
+        Args:
+            curvePath: curve dag path
+            interval: distance between points along the curve
+            samplesPerSpan: density of the arc-length table
+
+        Returns:
+            ((N, 3) points, (N, 3) unit tangents)
+    """
 
-    # iterate selected curves
-    for s in range(numSelected):
-        sel.getDagPath(s, dagPath)
+    cvs, knots, degree, (start, end) = getCurveData(curvePath)
+    numRivets = int(OpenMaya.MFnNurbsCurve(curvePath).length() / interval)
 
-        fnCurve = OpenMaya.MFnNurbsCurve(dagPath)
-        point = OpenMaya.MPoint()
-        start = 0.0
+    numSpans = max(len(cvs) - degree, 1)
+    numSamples = max(numSpans * samplesPerSpan, numRivets * 4, 2)
+    tableParams = np.linspace(start, end, numSamples)
+    tablePoints = evaluateCurve(cvs, knots, degree, tableParams)
 
-        N = OpenMaya.MVector()
-        length = fnCurve.length()
-        numRivets = int(length / interval)
+    segments = np.linalg.norm(np.diff(tablePoints, axis=0), axis=1)
+    lengths = np.concatenate(([0.0], np.cumsum(segments)))
 
-        rivets = []
+    targets = np.minimum(np.arange(numRivets) * interval, lengths[-1])
+    params = np.interp(targets, lengths, tableParams)
+    points = evaluateCurve(cvs, knots, degree, params)
 
-        # Closest Point
-        P = OpenMaya.MPoint()
+    # Central differences in param space
+    h = (end - start) * 1e-5
+    ahead = evaluateCurve(cvs, knots, degree, np.minimum(params + h, end))
+    behind = evaluateCurve(cvs, knots, degree, np.maximum(params - h, start))
+    tangents = normalize(ahead - behind)
 
-        for i in range(numRivets):
-            param = fnCurve.findParamFromLength(start)
-            fnCurve.getPointAtParam(param, point)
+    return points, tangents
 
-            # randomize point
-            randX = 1.0 + (random.uniform(-0.1, 0.1) * randomness)
-            randY = 1.0 + (random.uniform(-0.1, 0.1) * randomness)
-            randZ = 1.0 + (random.uniform(-0.1, 0.1) * randomness)
-            point.x = point.x * randX
-            point.y = point.y * randY
-            point.z = point.z * randZ
 
-            # Tangent vector
-            T = fnCurve.tangent(param)
+def normalize(vectors):
+    # type: (np.ndarray) -> np.ndarray
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(lengths > 0, lengths, 1.0)
+
+
+def getClosestNormals(surfacePath, points):
+    # type: (OpenMaya.MDagPath, np.ndarray) -> tuple
+    """ Closest surface points and normals
+        Args:
+            surfacePath: mesh dag path
+            points: (N, 3) world space points
 
-            # Normal vector
-            surfaceFnMesh.getClosestPointAndNormal(point, P, N, OpenMaya.MSpace.kWorld)
+        Returns:
+            ((N, 3) closest points, (N, 3) normals) in world space
+    """
 
-            # Bi-tangent vector
-            B = N ^ T
+    shapePath = OpenMaya.MDagPath(surfacePath)
+    shapePath.extendToShape()
+    matrix = shapePath.inclusiveMatrix()
+
+    intersector = OpenMaya.MMeshIntersector()
+    intersector.create(shapePath.node(), matrix)
 
-            # Normalize vectors
-            T.normalize()
-            N.normalize()
-            B.normalize()
+    # Queries are in world space, results come back in object space
+    closest = np.empty_like(points)
+    normals = np.empty_like(points)
+    for i, point in enumerate(points.tolist()):
+        pointOnMesh = intersector.getClosestPoint(OpenMaya.MPoint(point))
+        closest[i] = tuple(pointOnMesh.point)[:3]
+        normals[i] = tuple(pointOnMesh.normal)
+
+    world = np.array(matrix, dtype=np.float64).reshape(4, 4)
+    closest = closest.dot(world[:3, :3]) + world[3, :3]
+    normals = normals.dot(np.linalg.inv(world[:3, :3]).T)
 
-            # 4x4 transformation matrix
-            M = [T.x, T.y, T.z, 0,
-                 N.x, N.y, N.z, 0,
-                 B.x, B.y, B.z, 0,
-                 P.x, P.y, P.z, 1]
+    return closest, normalize(normals)
+
+
+def computeFrames(curvePath, surfacePath, interval, randomness):
+    # type: (OpenMaya.MDagPath, OpenMaya.MDagPath, float, float) -> np.ndarray
+    """ Rivet matrices along a curve
+        Args:
+            curvePath: curve dag path
+            surfacePath: mesh the rivets follow
+            interval: distance between rivets along the curve
+            randomness: position jitter
+
+        Returns:
+            (N, 4, 4) row-major world matrices, rows are tangent, normal,
+            bi-tangent and position
+    """
+
+    points, tangents = sampleCurve(curvePath, interval)
 
-            # Duplicate rivets and apply transformations
-            obj = cmds.duplicate(rivet)[0]
-            cmds.xform(obj, matrix=M)
+    # randomize point
+    points = points * (1.0 + np.random.uniform(-0.1, 0.1, points.shape) * randomness)
+
+    closest, normals = getClosestNormals(surfacePath, points)
+
+    matrices = np.zeros((len(points), 4, 4))
+    matrices[:, 0, :3] = tangents
+    matrices[:, 1, :3] = normals
+    matrices[:, 2, :3] = normalize(np.cross(normals, tangents))
+    matrices[:, 3, :3] = closest
+    matrices[:, 3, 3] = 1.0
+
+    return matrices
+
+
+def getChildren(dagPath):
+    # type: (OpenMaya.MDagPath) -> list
+    """ Shapes and transforms directly under a transform """
+
+    return [dagPath.child(i) for i in range(dagPath.childCount())]
+
+
+def getShadingMembers(rivet):
+    # type: (str) -> dict
+    """ Shading assignments of the shapes under the rivet
+        Args:
+            rivet: rivet transform full path
+
+        Returns:
+            {shading engine: [member relative to the rivet, ...]}, members
+            are whole shapes or face components
+    """
+
+    prefix = rivet + "|"
+    shapes = cmds.ls(
+        cmds.listRelatives(rivet, allDescendents=True, fullPath=True) or [],
+        type="shape",
+        noIntermediate=True,
+        long=True)
+
+    shadingEngines = set()
+    for shape in shapes:
+        shadingEngines.update(cmds.listConnections(
+            shape + ".instObjGroups", type="shadingEngine") or [])
 
-            start += interval
+    result = {}
+    for shadingEngine in shadingEngines:
+        members = cmds.ls(cmds.sets(shadingEngine, q=True) or [], long=True)
+        members = [i[len(prefix):] for i in members if i.startswith(prefix)]
+        if members:
+            result[shadingEngine] = members
+
+    return result
+
+
+def createInstances(rivet, matrices, groupName="rivets"):
+    # type: (str, np.ndarray, str) -> OpenMaya.MDagModifier
+    """ One transform per matrix holding instances of the rivet children
+        The new transforms take the place of the rivet transform, same as
+        cmds.xform on a duplicate, so a group rivet is placed the same way
+        in both modes.
 
-            rivets.append(obj)
+        Args:
+            rivet: rivet transform
+            matrices: (N, 4, 4) row-major matrices
+            groupName: name of the new group
+
+        Returns:
+            The MDagModifier that created everything, already done
+    """
+
+    rivetPath = getDagPath(rivet)
+    children = getChildren(rivetPath)
+    rivetName = rivet.rpartition("|")[2]
+    shadingMembers = getShadingMembers(rivetPath.fullPathName())
 
-        cmds.group(rivets)
+    modifier = OpenMaya.MDagModifier()
+    group = modifier.createNode("transform")
+    modifier.renameNode(group, groupName)
 
-    cmds.undoInfo(closeChunk=True)
+    transforms = []
+    for i in range(len(matrices)):
+        transform = modifier.createNode("transform", group)
+        modifier.renameNode(transform, "{}{}".format(rivetName, i + 1))
+        transforms.append(transform)
+
+    # Nodes have to exist before their plugs can be set
+    modifier.doIt()
+
+    fnNode = OpenMaya.MFnDependencyNode()
+    for transform, matrix in zip(transforms, matrices):
+        transformation = OpenMaya.MTransformationMatrix(
+            OpenMaya.MMatrix(matrix.ravel().tolist()))
+        translate = transformation.translation(OpenMaya.MSpace.kTransform)
+        rotate = transformation.rotation()
+        scale = transformation.scale(OpenMaya.MSpace.kTransform)
+
+        # Tangent and surface normal are not always perpendicular
+        shear = transformation.shear(OpenMaya.MSpace.kTransform)
+
+        fnNode.setObject(transform)
+        for name, values in (
+                ("translate", translate),
+                ("rotate", rotate),
+                ("scale", scale),
+                ("shear", shear)):
+            plug = fnNode.findPlug(name, False)
+            for axis in range(3):
+                modifier.newPlugValueDouble(plug.child(axis), values[axis])
+
+        for child in children:
+            modifier.addChild(child, transform)
+
+    modifier.doIt()
+
+    # New instances are not in any shading engine yet, one undoable sets
+    # command per shading engine for every instance
+    paths = [OpenMaya.MFnDagNode(i).fullPathName() for i in transforms]
+    for shadingEngine, members in shadingMembers.items():
+        modifier.commandToExecute("sets -e -forceElement {} {};".format(
+            shadingEngine,
+            " ".join("{}|{}".format(path, member)
+                     for path in paths for member in members)))
+
+    modifier.doIt()
+
+    return modifier
+
+
+def createDuplicates(rivet, matrices):
+    # type: (str, np.ndarray) -> list
+    """ Full copies of the rivet, one cmds.duplicate per matrix """
+
+    rivets = []
+    for matrix in matrices:
+        obj = cmds.duplicate(rivet)[0]
+        cmds.xform(obj, matrix=matrix.ravel().tolist())
+        rivets.append(obj)
+
+    return rivets
+
+
+def duplicateAloneCurves(surface, rivet, interval, randomness, mode=INSTANCE_MODE):
+    """ duplicate alone curve """
+
+    curves = OpenMaya.MGlobal.getActiveSelectionList()
+
+    # Setup snap target surface
+    surfacePath = getDagPath(surface)
+
+    # Compute every frame before creating anything
+    frames = []
+    for i in range(curves.length()):
+        curvePath = curves.getDagPath(i)
+        matrices = computeFrames(curvePath, surfacePath, interval, randomness)
+        frames.append((curvePath.partialPathName(), matrices))
+
+    if mode == DUPLICATE_MODE:
+        cmds.undoInfo(openChunk=True)
+        try:
+            for _, matrices in frames:
+                cmds.group(createDuplicates(rivet, matrices))
+        finally:
+            cmds.undoInfo(closeChunk=True)
+        return
+
+    modifiers = [
+        createInstances(rivet, matrices, curveName + "_rivets")
+        for curveName, matrices in frames]
+
+    def undoIt():
+        for modifier in reversed(modifiers):
+            modifier.undoIt()
+
+    def redoIt():
+        for modifier in modifiers:
+            modifier.doIt()
+
+    apiundo.commit(undo=lambda *args: undoIt(), redo=lambda *args: redoIt())
 
 
 if __name__ == "__main__":
     w = GUI()
     w.show()
-
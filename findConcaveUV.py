@@ -1,50 +1,350 @@
-from maya.api import OpenMaya
-from maya import cmds
+""" Find concave, flipped and zero area uv faces
+
+main() selects the bad faces of the selected mesh. The validation mode
+checks every mesh under a root, or exported mesh files, across all uv sets
+in a process pool and writes a JSON or CSV report.
+
+Usage:
+    mayapy findConcaveUV.py --scene asset.ma --root asset_GRP -o report.json
+    python findConcaveUV.py meshes/*.npz -o report.csv
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+
+from uvResizer import meshArea
+from uvResizer import meshData
+from uvResizer import uvOverlap
+from uvResizer import workerPool
+
+try:
+    from maya.api import OpenMaya
+    from maya import cmds
+    import componentSelection
+except ImportError:
+    # Exported mesh files can be validated outside of maya
+    OpenMaya = None
+
+
+CONCAVE = "concave"
+FLIPPED = "flipped"
+ZERO_AREA = "zeroArea"
 
 
 def getTriangleArea(Ax, Ay, Bx, By, Cx, Cy):
     return (Ax * (By - Cy) + Bx * (Cy - Ay) + Cx * (Ay - By)) / 2
 
 
-def main():
+def classifyFaces(uArray, vArray, uvCounts, uvIds, tolerance=0.00000000001):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, float) -> dict
+    """ Classify every face from its face-vertex uvs in one pass
+        Args:
+            uArray: u values
+            vArray: v values
+            uvCounts: number of uvs per face, 0 for faces without uvs
+            uvIds: uv ids of all face-vertices
+            tolerance: areas below this are treated as zero
+
+        Returns:
+            Face indices per category, CONCAVE, FLIPPED and ZERO_AREA
+    """
+
+    uArray = np.asarray(uArray, dtype=np.float64)
+    vArray = np.asarray(vArray, dtype=np.float64)
+    uvCounts = np.asarray(uvCounts, dtype=np.int64)
+    uvIds = np.asarray(uvIds, dtype=np.int64)
+
+    numFaces = len(uvCounts)
+    faceIds = np.repeat(np.arange(numFaces), uvCounts)
+    starts = np.repeat(np.cumsum(uvCounts) - uvCounts, uvCounts)
+    counts = np.repeat(uvCounts, uvCounts)
+    local = np.arange(len(uvIds)) - starts
+
+    # Every corner with its two following corners in the same face
+    p1 = uvIds
+    p2 = uvIds[starts + (local + 1) % counts]
+    p3 = uvIds[starts + (local + 2) % counts]
+
+    cornerAreas = getTriangleArea(
+        uArray[p1], vArray[p1],
+        uArray[p2], vArray[p2],
+        uArray[p3], vArray[p3])
+
+    # Signed polygon area, shoelace formula
+    faceAreas = np.bincount(
+        faceIds,
+        weights=(uArray[p1] * vArray[p2] - uArray[p2] * vArray[p1]) / 2,
+        minlength=numFaces)
+
+    mapped = uvCounts > 0
+    zeroArea = mapped & (np.abs(faceAreas) <= tolerance)
+    flipped = mapped & (faceAreas < -tolerance)
+
+    # A corner turning against the face orientation makes it concave
+    orientation = np.where(faceAreas < 0, -1.0, 1.0)[faceIds]
+    badCorners = cornerAreas * orientation <= tolerance
+    concave = np.bincount(faceIds[badCorners], minlength=numFaces) > 0
+    concave &= mapped & ~zeroArea & ~flipped
+
+    return {
+        CONCAVE: np.flatnonzero(concave),
+        FLIPPED: np.flatnonzero(flipped),
+        ZERO_AREA: np.flatnonzero(zeroArea)}
+
+
+def checkMesh(dagPath, uvSet=None):
+    # type: (OpenMaya.MDagPath, str) -> dict
+    """ Classify the faces of a mesh
+        Args:
+            dagPath: mesh dag path
+            uvSet: uv set name, current uv set by default
+
+        Returns:
+            Face indices per category, see classifyFaces
+    """
+
+    uvSetArgs = (uvSet,) if uvSet else ()
+
+    mesh = OpenMaya.MFnMesh(dagPath)
+    uArray, vArray = mesh.getUVs(*uvSetArgs)
+    uvCounts, uvIds = mesh.getAssignedUVs(*uvSetArgs)
+
+    return classifyFaces(uArray, vArray, uvCounts, uvIds)
+
+
+def main(categories=(CONCAVE, FLIPPED, ZERO_AREA)):
     sel = OpenMaya.MGlobal.getActiveSelectionList()
     dagPath = sel.getDagPath(0)
 
-    itPoly = OpenMaya.MItMeshPolygon(dagPath)
+    result = checkMesh(dagPath)
+
+    for category in (CONCAVE, FLIPPED, ZERO_AREA):
+        print("{}: {} faces".format(category, len(result[category])))
+
+    badFaces = np.unique(np.concatenate(
+        [result[i] for i in categories] + [np.zeros(0, dtype=np.int64)]))
+
+    componentSelection.setSelection(dagPath, componentSelection.FACE, badFaces)
+
+    return result
+
+
+def _indexList(indices):
+    return np.asarray(indices).tolist()
+
+
+def validateMeshData(data, uvSet=None, textureSize=1024):
+    # type: (meshData.MeshData, str, int) -> dict
+    """ Validate the uvs of a mesh
+        Args:
+            data: MeshData
+            uvSet: uv set name the data was read from, for the report
+            textureSize: texture resolution for the texel density
+
+        Returns:
+            Report dict, JSON serializable
+    """
+
+    faces = classifyFaces(data.uArray, data.vArray, data.uvCounts, data.uvIds)
+
+    numShells, shellIds = data.getUvShellIds()
+    polyAreas, uvAreas = meshArea.shellAreas(data, shellIds, numShells)
+    faceShells = meshArea.faceShellIds(data, shellIds)
+
+    outside = np.flatnonzero(
+        (data.uArray < 0) | (data.uArray > 1) |
+        (data.vArray < 0) | (data.vArray > 1))
+
+    overlaps, overlappingFaces = uvOverlap.meshOverlaps(data)
+
+    # Texel ratio is uv area / polygon area as in uvResizer,
+    # density is texels per unit length
+    ratios = np.full(numShells, np.nan)
+    valid = polyAreas > 0
+    ratios[valid] = uvAreas[valid] / polyAreas[valid]
+    densities = np.sqrt(ratios) * textureSize
+
+    shells = []
+    counts = {}
+    for category, indices in faces.items():
+        counts[category] = np.bincount(
+            faceShells[indices][faceShells[indices] >= 0],
+            minlength=numShells)
+    counts["outside"] = np.bincount(shellIds[outside], minlength=numShells)
+    counts["overlaps"] = np.bincount(overlaps.ravel(), minlength=numShells)
+
+    for i in range(numShells):
+        shell = {
+            "shell": i,
+            "polyArea": float(polyAreas[i]),
+            "uvArea": float(uvAreas[i]),
+            "texelRatio": None if np.isnan(ratios[i]) else float(ratios[i]),
+            "texelDensity":
+                None if np.isnan(densities[i]) else float(densities[i])}
+        for category in (CONCAVE, FLIPPED, ZERO_AREA, "outside", "overlaps"):
+            shell[category] = int(counts[category][i])
+        shells.append(shell)
+
+    return {
+        "mesh": data.name,
+        "uvSet": uvSet,
+        "numFaces": data.numFaces,
+        "numUVs": data.numUVs,
+        "numShells": numShells,
+        CONCAVE: _indexList(faces[CONCAVE]),
+        FLIPPED: _indexList(faces[FLIPPED]),
+        ZERO_AREA: _indexList(faces[ZERO_AREA]),
+        "outsideUVs": _indexList(outside),
+        "overlappingShells": _indexList(overlaps),
+        "overlappingFaces": _indexList(overlappingFaces),
+        "shells": shells}
+
+
+def getMeshData(root=None, space=None):
+    # type: (str, OpenMaya.MSpace) -> list
+    """ Pull every mesh under a root out of maya, once per uv set
+        Args:
+            root: dag node, every mesh in the scene if None
+            space: MSpace for the point positions, world by default
+
+        Returns:
+            List of (MeshData, uv set name)
+    """
+
+    if root is None:
+        paths = cmds.ls(type="mesh", noIntermediate=True, long=True)
+    else:
+        paths = cmds.ls(
+            root, dag=True, type="mesh", noIntermediate=True, long=True)
+
+    result = []
+
+    for path in paths or []:
+        sel = OpenMaya.MSelectionList()
+        sel.add(path)
+        dagPath = sel.getDagPath(0)
+
+        for uvSet in OpenMaya.MFnMesh(dagPath).getUVSetNames():
+            data = meshData.MeshData.fromDagPath(
+                dagPath, space, uvSet, shells=True)
+            result.append((data, uvSet))
+
+    return result
+
+
+def _validateJob(job):
+    data, uvSet, textureSize = job
+    if not isinstance(data, meshData.MeshData):
+        data = meshData.MeshData.load(data)
+    return validateMeshData(data, uvSet, textureSize)
+
+
+def validateMeshes(meshes, textureSize=1024, processes=None):
+    # type: (list, int, int) -> list
+    """ Validate meshes with a process pool
+        Args:
+            meshes: List of (MeshData or exported mesh file, uv set name)
+            textureSize: texture resolution for the texel density
+            processes: number of worker processes, cpu count if None.
+                       Runs in this process if no mayapy is found.
+
+        Returns:
+            List of reports, same order as meshes
+    """
+
+    jobs = [(data, uvSet, textureSize) for data, uvSet in meshes]
+
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = workerPool.getPool(processes)
+
+    if pool is None:
+        return list(map(_validateJob, jobs))
+
+    try:
+        return pool.map(_validateJob, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+CSV_FIELDS = (
+    "mesh", "uvSet", "shell", "polyArea", "uvArea", "texelRatio",
+    "texelDensity", CONCAVE, FLIPPED, ZERO_AREA, "outside", "overlaps")
+
+
+def writeReport(reports, path):
+    # type: (list, str) -> None
+    """ Write reports as JSON, or as CSV with one row per shell
+        Args:
+            reports: List of report dicts from validateMeshData
+            path: .json or .csv file path
+
+        Returns:
+            None
+    """
+
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, CSV_FIELDS)
+            writer.writeheader()
+            for report in reports:
+                for shell in report["shells"]:
+                    row = dict(shell, mesh=report["mesh"], uvSet=report["uvSet"])
+                    writer.writerow(row)
+    else:
+        with open(path, "w") as f:
+            json.dump(reports, f, indent=2)
 
-    badUVs = []
 
-    while not itPoly.isDone():
-        _, ids = itPoly.getTriangles()
-        numVerts = itPoly.polygonVertexCount()
-        for i in range(numVerts):
-            p1 = i
-            p2 = i + 1
-            if p2 > numVerts-1:
-                p2 -= numVerts
-            p3 = i + 2
-            if p3 > numVerts-1:
-                p3 -= numVerts
-            uv = [p1, p2, p3]
-            b = [itPoly.getUV(i) for i in uv]
+def validate(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check uvs of many meshes and write a report")
+    parser.add_argument("meshes", nargs="*", help="exported mesh files")
+    parser.add_argument("--scene", help="maya scene to open (mayapy)")
+    parser.add_argument("--root", help="check meshes under this node only")
+    parser.add_argument(
+        "-o", "--output", required=True, help=".json or .csv report")
+    parser.add_argument("--texture-size", type=int, default=1024)
+    parser.add_argument("-p", "--processes", type=int, default=None)
+    args = parser.parse_args(argv)
 
-            area = getTriangleArea(
-                b[0][0],
-                b[0][1],
-                b[1][0],
-                b[1][1],
-                b[2][0],
-                b[2][1])
+    t = time.time()
 
-            if area <= 0.00000000001:
-                badUVs.append(itPoly.index())
+    meshes = [(i, None) for i in args.meshes]
 
-        itPoly.next()
+    if args.scene:
+        if OpenMaya is None:
+            parser.error("--scene needs maya, use mayapy")
+        import maya.standalone
+        maya.standalone.initialize()
+        cmds.file(args.scene, open=True, force=True)
+        meshes.extend(getMeshData(args.root))
 
-    badFaces = [dagPath.fullPathName() + ".f[{}]".format(i) for i in badUVs]
+    reports = validateMeshes(meshes, args.texture_size, args.processes)
+    writeReport(reports, args.output)
 
-    cmds.select(badFaces, r=True)
+    for report in reports:
+        print("{} ({}): {} concave, {} flipped, {} zero area, "
+              "{} uvs outside 0-1, {} overlapping shell pairs".format(
+                  report["mesh"],
+                  report["uvSet"],
+                  len(report[CONCAVE]),
+                  len(report[FLIPPED]),
+                  len(report[ZERO_AREA]),
+                  len(report["outsideUVs"]),
+                  len(report["overlappingShells"])))
+    print("Checked {} uv sets in {:.2f}s".format(
+        len(reports), time.time() - t))
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:]:
+        validate()
+    else:
+        main()
@@ -1,32 +1,120 @@
+""" Find and freeze vertex tweaks (pnts) on meshes
+
+scan() reads the pnts array of every mesh under any number of roots in
+bulk and reports the tweak magnitudes, fast enough for a publish check.
+freeze() bakes the tweaks into the vertex positions with a couple of bulk
+writes per mesh, in one undo chunk.
+"""
+
 from maya.api import OpenMaya
 from maya import cmds
+import numpy as np
 import time
 
+from uvResizer import meshData
 
-def checkIt(plug):
-    dataHandle = plug.asMDataHandle()
-    arrayDataHandle = OpenMaya.MArrayDataHandle(dataHandle)
-    while not arrayDataHandle.isDone():
-        outputHandle = arrayDataHandle.outputValue()
-        x, y, z = outputHandle.asFloat3()
-        if x != 0.0:
-            plug.destructHandle(dataHandle)
-            return True
-        if y != 0.0:
-            plug.destructHandle(dataHandle)
-            return True
-        if z != 0.0:
-            plug.destructHandle(dataHandle)
-            return True
-        arrayDataHandle.next()
 
-    return False
+def getMeshes(roots=None):
+    # type: (list) -> list
+    """ Mesh shapes under roots, every mesh in the scene if None """
+
+    if roots is None:
+        meshes = cmds.ls(type="mesh", noIntermediate=True, long=True)
+    else:
+        meshes = cmds.ls(
+            roots, dag=True, type="mesh", noIntermediate=True, long=True)
+
+    return meshes or []
+
+
+def getTweaks(dagPath):
+    # type: (OpenMaya.MDagPath) -> tuple
+    """ Read the pnts array in one getAttr call
+        The array is sparse, only the existing elements are returned.
+
+        Args:
+            dagPath: mesh shape dag path
+
+        Returns:
+            (sorted vertex indices, (N, 3) offsets of those vertices)
+    """
+
+    plug = OpenMaya.MFnDagNode(dagPath).findPlug("pnts", False)
+
+    # Most meshes never had a tweak
+    if plug.numElements() == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 3))
+
+    indices = np.unique(meshData.toArray(
+        plug.getExistingArrayAttributeIndices(), np.int64))
+    first = int(indices[0])
+    last = int(indices[-1])
+
+    values = cmds.getAttr("{}.pnts[{}:{}]".format(
+        dagPath.fullPathName(), first, last))
+    offsets = np.asarray(values, dtype=np.float64).reshape(-1, 3)
+
+    # One row per index of the range, or per existing element
+    if len(offsets) == last - first + 1:
+        return indices, offsets[indices - first]
+    if len(offsets) == len(indices):
+        return indices, offsets
+
+    # Unknown layout, read the elements one by one
+    offsets = np.empty((len(indices), 3))
+    for row, index in enumerate(indices.tolist()):
+        element = plug.elementByLogicalIndex(index)
+        offsets[row] = [element.child(i).asFloat() for i in range(3)]
+
+    return indices, offsets
+
+
+def checkIt(dagPath, tolerance=0.0):
+    # type: (OpenMaya.MDagPath, float) -> bool
+    """ True if any pnts value is larger than the tolerance """
+
+    _, offsets = getTweaks(dagPath)
+    return bool(np.any(np.abs(offsets) > tolerance))
+
+
+def scan(roots=None, tolerance=0.0):
+    # type: (list, float) -> list
+    """ Find meshes with tweaks
+        Args:
+            roots: dag nodes to search under, every mesh if None
+            tolerance: offsets up to this size are ignored
+
+        Returns:
+            List of dicts with the mesh path, the number of tweaked
+            vertices and the max and mean tweak length
+    """
+
+    result = []
+    sel = OpenMaya.MSelectionList()
+
+    for path in getMeshes(roots):
+        sel.clear()
+        sel.add(path)
+        _, offsets = getTweaks(sel.getDagPath(0))
+
+        tweaked = np.any(np.abs(offsets) > tolerance, axis=1)
+        if not tweaked.any():
+            continue
+
+        lengths = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))[tweaked]
+        result.append({
+            "mesh": path,
+            "tweakedVertices": int(np.count_nonzero(tweaked)),
+            "maxOffset": float(lengths.max()),
+            "meanOffset": float(lengths.mean())})
+
+    return result
 
 
 def fixIt(plug, path):
     # fix most vertices
     cmds.polyMoveVertex(path, lt=(0, 0, 0), nodeState=1, ch=False)
-    
+
     # Sometimes the above comand doesn't fix very small number such as 0.000.....1
     # So manually reset those numbers to 0
     dataHandle = plug.asMDataHandle()
@@ -39,26 +127,119 @@ def fixIt(plug, path):
     plug.destructHandle(dataHandle)
 
 
-def main(fix=False):
-    result = []
-    
-    mSel = OpenMaya.MSelectionList()
-    sel = cmds.ls(sl=True, fl=True, long=True)[0]
-    mesh = cmds.listRelatives(sel, ad=True, fullPath=True, type="mesh") or []
-    
-    for i in mesh:
-        mSel.add(i)
-    
-    for num, obj in enumerate(mesh):
-        dagPath = mSel.getDagPath(num)
-        dagNode = OpenMaya.MFnDagNode(dagPath)
-        plug = dagNode.findPlug("pnts", False)
-        hasTransform = checkIt(plug)
-        
-        if hasTransform:
-            result.append(dagPath.fullPathName())
-            if fix:
-                fixIt(plug, dagPath.fullPathName())
+def hasHistory(dagPath):
+    # type: (OpenMaya.MDagPath) -> bool
+    """ True if the mesh is driven by an input connection """
+
+    plug = OpenMaya.MFnDagNode(dagPath).findPlug("inMesh", False)
+    return plug.isDestination
+
+
+def freezeIt(dagPath, tolerance=0.0):
+    # type: (OpenMaya.MDagPath, float) -> int
+    """ Bake pnts into the vertex positions of a mesh without history
+        Args:
+            dagPath: mesh shape dag path
+            tolerance: offsets up to this size are not counted as changes
+
+        Returns:
+            Number of vertices that moved
+    """
+
+    indices, offsets = getTweaks(dagPath)
+    if len(indices) == 0:
+        return 0
+
+    path = dagPath.fullPathName()
+    first = int(indices[0])
+    last = int(indices[-1])
+
+    # Final positions already include the tweaks
+    fnMesh = OpenMaya.MFnMesh(dagPath)
+    points = meshData.toPointArray(fnMesh.getPoints(OpenMaya.MSpace.kObject))
+    lastVertex = min(last, len(points) - 1)
+
+    cmds.setAttr(
+        "{}.pnts[{}:{}]".format(path, first, last),
+        *np.zeros(3 * (last - first + 1)).tolist(),
+        type="float3")
+
+    if lastVertex >= first:
+        cmds.setAttr(
+            "{}.vrts[{}:{}]".format(path, first, lastVertex),
+            *points[first:lastVertex + 1].ravel().tolist())
+
+    # Tweaks on indices past the last vertex don't move anything
+    offsets = offsets[indices <= lastVertex]
+    changed = np.any(np.abs(offsets) > tolerance, axis=1)
+    return int(np.count_nonzero(changed))
+
+
+def freeze(roots=None, tolerance=0.0):
+    # type: (list, float) -> dict
+    """ Freeze tweaks of all meshes under roots in one undo chunk
+        Meshes with history are frozen with the slower fixIt.
+
+        Args:
+            roots: dag nodes to search under, every mesh if None
+            tolerance: offsets up to this size are not counted as changes
+
+        Returns:
+            Number of moved vertices per mesh
+    """
+
+    result = {}
+    sel = OpenMaya.MSelectionList()
+
+    cmds.undoInfo(openChunk=True, chunkName="freezePntsAttr")
+    try:
+        for info in scan(roots, tolerance):
+            path = info["mesh"]
+            sel.clear()
+            sel.add(path)
+            dagPath = sel.getDagPath(0)
+
+            if hasHistory(dagPath):
+                plug = OpenMaya.MFnDagNode(dagPath).findPlug("pnts", False)
+                fixIt(plug, path)
+                result[path] = info["tweakedVertices"]
+            else:
+                result[path] = freezeIt(dagPath, tolerance)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+    return result
+
+
+def main(fix=False, roots=None):
+    """ Scan or freeze meshes under roots, the selection if None
+        Use scan(None) or freeze(None) for every mesh in the scene.
+    """
+
+    t = time.time()
+
+    if roots is None:
+        roots = cmds.ls(sl=True, long=True)
+        if not roots:
+            cmds.error("Nothing is selected, select root groups.")
+
+    if fix:
+        result = freeze(roots)
+        for path in sorted(result):
+            print("{}: {} vertices".format(path, result[path]))
+        print("Froze {} vertices on {} meshes in {:.2f}s".format(
+            sum(result.values()), len(result), time.time() - t))
+        return result
+
+    result = scan(roots)
+
+    for i in result:
+        print("{mesh}: {tweakedVertices} vertices, "
+              "max {maxOffset:.6g}, mean {meanOffset:.6g}".format(**i))
+    print("{} meshes with tweaks, checked in {:.2f}s".format(
+        len(result), time.time() - t))
+
+    return result
 
 
 if __name__ == "__main__":
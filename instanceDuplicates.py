@@ -0,0 +1,271 @@
+""" Find identical meshes and replace the duplicates with instances
+
+Meshes are hashed from their topology, object space positions, uvs,
+normals and hard edges, so 100k meshes are grouped with one hash lookup each instead of pairwise
+comparisons. Candidates sharing a hash are verified against each other
+before anything is instanced. Every duplicate keeps its transform, only
+the shape under it is replaced by an instance of the first mesh.
+"""
+
+import hashlib
+import time
+
+from maya import cmds
+from maya.api import OpenMaya
+import numpy as np
+
+from uvResizer import meshData
+
+
+def getMeshes(roots=None):
+    # type: (list) -> list
+    """ Mesh shapes under roots, every mesh in the scene if None """
+
+    if roots is None:
+        meshes = cmds.ls(type="mesh", noIntermediate=True, long=True)
+    else:
+        meshes = cmds.ls(
+            roots, dag=True, type="mesh", noIntermediate=True, long=True)
+
+    return meshes or []
+
+
+def getMeshArrays(dagPath):
+    # type: (OpenMaya.MDagPath) -> tuple
+    """ Arrays that have to match for two meshes to be instances
+
+        Returns:
+            (points, polygon counts, polygon connects, u, v, uv counts,
+             uv ids, normals, normal ids, locked normals, smooth edges),
+            points and normals in object space
+    """
+
+    fnMesh = OpenMaya.MFnMesh(dagPath)
+    polygonCounts, polygonConnects = fnMesh.getVertices()
+    uArray, vArray = fnMesh.getUVs()
+    uvCounts, uvIds = fnMesh.getAssignedUVs()
+    _, normalIds = fnMesh.getNormalIds()
+
+    normals = fnMesh.getNormals(OpenMaya.MSpace.kObject)
+    normalArray = np.zeros((len(normals), 3), dtype=np.float32)
+    if len(normals):
+        normalArray[:] = np.array(normals, dtype=np.float32)[:, :3]
+
+    # No bulk query for these, one call per normal and edge
+    locked = np.fromiter(
+        (fnMesh.isNormalLocked(i) for i in range(len(normals))),
+        dtype=bool, count=len(normals))
+    smooth = np.fromiter(
+        (fnMesh.isEdgeSmooth(i) for i in range(fnMesh.numEdges)),
+        dtype=bool, count=fnMesh.numEdges)
+
+    return (
+        meshData.toPointArray(fnMesh.getPoints(OpenMaya.MSpace.kObject)),
+        meshData.toArray(polygonCounts, np.int32),
+        meshData.toArray(polygonConnects, np.int32),
+        meshData.toArray(uArray, np.float32),
+        meshData.toArray(vArray, np.float32),
+        meshData.toArray(uvCounts, np.int32),
+        meshData.toArray(uvIds, np.int32),
+        normalArray,
+        meshData.toArray(normalIds, np.int32),
+        locked,
+        smooth)
+
+
+def getMeshHash(arrays, tolerance):
+    # type: (tuple, float) -> tuple
+    """ Hash key of mesh arrays
+        Float values are rounded to a grid of tolerance size. Two values
+        closer than tolerance can still round to neighbouring grid
+        cells, so meshes that only match within tolerance may get
+        different keys and are not found. Exact copies always match.
+
+        Args:
+            arrays: from getMeshArrays
+            tolerance: positions, uvs and normals are snapped to this grid
+
+        Returns:
+            (vertex count, face count, uv count, digest)
+    """
+
+    points, polygonCounts = arrays[:2]
+    uArray = arrays[3]
+
+    digest = hashlib.sha1()
+    for i in arrays:
+        if i.dtype.kind == "f":
+            i = np.round(i / tolerance).astype(np.int64)
+        digest.update(i.tobytes())
+
+    return (len(points), len(polygonCounts), len(uArray), digest.hexdigest())
+
+
+def isSame(arraysA, arraysB, tolerance):
+    # type: (tuple, tuple, float) -> bool
+    """ Exact topology, smoothing and locked normals, positions, uvs and
+        normals within tolerance
+    """
+
+    for a, b in zip(arraysA, arraysB):
+        if a.shape != b.shape:
+            return False
+        if a.dtype.kind == "f":
+            if not np.allclose(a, b, rtol=0.0, atol=tolerance):
+                return False
+        elif not np.array_equal(a, b):
+            return False
+
+    return True
+
+
+def getMemorySize(arrays):
+    # type: (tuple) -> int
+    """ Approximate bytes of mesh data an instance doesn't have to store """
+
+    points = arrays[0]
+    return int(points.size * 4 + sum(i.nbytes for i in arrays[1:]))
+
+
+def getDagPath(path):
+    # type: (str) -> OpenMaya.MDagPath
+    sel = OpenMaya.MSelectionList()
+    sel.add(path)
+    return sel.getDagPath(0)
+
+
+def findDuplicates(roots=None, tolerance=1e-5):
+    # type: (list, float) -> list
+    """ Group identical meshes
+        Args:
+            roots: dag nodes to search under, every mesh if None
+            tolerance: max difference of positions, uvs and normals.
+                       Meshes that only match within tolerance can be
+                       missed, see getMeshHash.
+
+        Returns:
+            List of (shape paths, bytes per mesh), groups of two or more
+            identical meshes, the first shape is kept
+    """
+
+    # Hash every mesh, only the keys are kept in memory
+    buckets = {}
+    for path in getMeshes(roots):
+        dagPath = getDagPath(path)
+
+        # Already shared or driven by history
+        if OpenMaya.MFnDagNode(dagPath).isInstanced(False):
+            continue
+        if OpenMaya.MFnDagNode(dagPath).findPlug("inMesh", False).isDestination:
+            continue
+
+        key = getMeshHash(getMeshArrays(dagPath), tolerance)
+        buckets.setdefault(key, []).append(path)
+
+    groups = []
+
+    # Verify candidates that share a hash
+    for paths in buckets.values():
+        if len(paths) < 2:
+            continue
+
+        representatives = []
+        for path in paths:
+            arrays = getMeshArrays(getDagPath(path))
+            for repArrays, members in representatives:
+                if isSame(repArrays, arrays, tolerance):
+                    members.append(path)
+                    break
+            else:
+                representatives.append((arrays, [path]))
+
+        for arrays, members in representatives:
+            if len(members) > 1:
+                groups.append((members, getMemorySize(arrays)))
+
+    return groups
+
+
+def getShadingEngines(path):
+    # type: (str) -> list
+    return list(set(cmds.listConnections(
+        path + ".instObjGroups", type="shadingEngine") or []))
+
+
+def instanceDuplicates(groups):
+    # type: (list) -> tuple
+    """ Replace duplicate shapes with instances of the first shape
+        Duplicates with per-face shading are left alone, the shading of
+        an instance can only be assigned per instance.
+
+        Args:
+            groups: from findDuplicates
+
+        Returns:
+            (number of instanced meshes, approximate bytes saved)
+    """
+
+    numInstanced = 0
+    saved = 0
+
+    cmds.undoInfo(openChunk=True, chunkName="instanceDuplicates")
+    try:
+        for paths, size in groups:
+            source = paths[0]
+            shapeName = source.rpartition("|")[2]
+
+            for path in paths[1:]:
+                shadingEngines = getShadingEngines(path)
+                if len(shadingEngines) > 1:
+                    continue
+
+                transform = cmds.listRelatives(path, parent=True, fullPath=True)[0]
+                cmds.delete(path)
+                cmds.parent(source, transform, add=True, shape=True)
+                if shadingEngines:
+                    cmds.sets(
+                        transform + "|" + shapeName,
+                        e=True,
+                        forceElement=shadingEngines[0])
+                numInstanced += 1
+                saved += size
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+    return numInstanced, saved
+
+
+def main(replace=False, roots=None, tolerance=1e-5):
+    # type: (bool, list, float) -> list
+    """ Find or instance duplicate meshes under roots, the selection if None
+        Use findDuplicates(None) and instanceDuplicates for every mesh in
+        the scene.
+    """
+
+    t = time.time()
+
+    if roots is None:
+        roots = cmds.ls(sl=True, long=True)
+        if not roots:
+            cmds.error("Nothing is selected, select root groups.")
+
+    groups = findDuplicates(roots, tolerance)
+    numDuplicates = sum(len(paths) - 1 for paths, _ in groups)
+    size = sum((len(paths) - 1) * i for paths, i in groups)
+
+    for paths, _ in groups:
+        print("{}: {} duplicates".format(paths[0], len(paths) - 1))
+
+    if replace:
+        numDuplicates, size = instanceDuplicates(groups)
+        print("Instanced {} meshes, saved about {:.1f} MB in {:.2f}s".format(
+            numDuplicates, size / 1024.0 / 1024.0, time.time() - t))
+    else:
+        print("{} duplicate meshes, about {:.1f} MB, found in {:.2f}s".format(
+            numDuplicates, size / 1024.0 / 1024.0, time.time() - t))
+
+    return groups
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,653 @@
+# -*- coding: utf-8 -*-
+
+""" Batched nearest neighbour search for 2d/3d points
+
+Two backends with the same interface:
+    GridIndex: uniform grid spatial hash in pure numpy
+    KDTreeIndex: scipy.spatial.cKDTree, used when scipy is available
+
+    index = createIndex(points)
+    distances, indices = index.query(queryPoints, k=1)
+
+Queries without a neighbour (eg. beyond distanceUpperBound) get an
+infinite distance and the index len(points), same as cKDTree.
+"""
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def expandRanges(starts, ends):
+    # type: (np.ndarray, np.ndarray) -> tuple
+    """ Expand [start, end) ranges into flat positions
+        Args:
+            starts: range starts
+            ends: exclusive range ends
+
+        Returns:
+            (positions, range index of each position)
+    """
+
+    lengths = ends - starts
+    rangeIds = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    positions = np.arange(offsets[-1], dtype=np.int64) \
+        - offsets[rangeIds] + starts[rangeIds]
+
+    return positions, rangeIds
+
+
+def kthSmallest(groupIds, values, numGroups, k):
+    # type: (np.ndarray, np.ndarray, int, int) -> np.ndarray
+    """ k-th smallest value of every group
+        Args:
+            groupIds: sorted group id of each value
+            values: values
+            numGroups: number of groups
+            k: rank starting at 1
+
+        Returns:
+            (numGroups,) values, inf for groups with less than k values
+    """
+
+    result = np.full(numGroups, np.inf)
+    if len(groupIds) == 0:
+        return result
+
+    if k > 1:
+        sortOrder = np.lexsort((values, groupIds))
+        groupIds = groupIds[sortOrder]
+        values = values[sortOrder]
+
+    isStart = np.concatenate(([True], groupIds[1:] != groupIds[:-1]))
+    groupStarts = np.flatnonzero(isStart)
+
+    if k == 1:
+        result[groupIds[groupStarts]] = np.minimum.reduceat(
+            values, groupStarts)
+        return result
+
+    rank = np.arange(len(groupIds)) - groupStarts[np.cumsum(isStart) - 1]
+    isKth = rank == k - 1
+    result[groupIds[isKth]] = values[isKth]
+
+    return result
+
+
+class GridIndex(object):
+    """ Uniform grid spatial hash with a pyramid of coarser grids
+
+        Points are sorted along a z-order curve of their cells, so every
+        occupied cell is a contiguous range, and so is every occupied cell
+        of the 2x, 4x, ... coarser grids. Empty cells cost nothing.
+
+        Queries search small blocks of cells around the query cell until
+        the k-th candidate is provably the k-th nearest point. Queries that
+        are still unresolved when the block gets too large, eg. far from
+        the points or next to a dense cluster, descend the pyramid from the
+        top cell instead. Every level keeps only the occupied cells that
+        can still hold one of the k nearest points.
+
+        The resolution is capped so cell keys fit into an int64. When that
+        makes cells larger than asked for, crowded cells get a finer grid
+        of their own.
+    """
+
+    # Upper bound of cells searched per query before the pyramid
+    maxBlockCells = 125
+
+    # Upper bound of cells or candidate distances evaluated at once
+    candidateBudget = 1 << 22
+
+    # Points per cell above which a capped cell gets its own grid
+    maxCellPoints = 64
+
+    def __init__(self, points, pointsPerCell=2.0, cellSize=None):
+        # type: (np.ndarray, float, float) -> None
+        """
+            Args:
+                points: (N, dim) points
+                pointsPerCell: average points per cell of the bulk
+                cellSize: cell size, derived from pointsPerCell if None
+        """
+
+        self.points = np.asarray(points, dtype=np.float64)
+        if self.points.ndim != 2:
+            raise ValueError("points must be a (N, dim) array")
+
+        numPoints, self.dim = self.points.shape
+
+        if numPoints:
+            self.origin = self.points.min(axis=0)
+            extent = self.points.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(self.dim)
+            extent = np.zeros(self.dim)
+
+        # Cell keys interleave the bits of all axes into one int64
+        maxResolution = 1 << (62 // max(self.dim, 1))
+
+        self.pointsPerCell = pointsPerCell
+        if cellSize is None:
+            cellSize = self._getCellSize(extent, pointsPerCell)
+        self.cellSize = max(
+            cellSize, float(extent.max()) / (maxResolution - 1), 1e-12)
+
+        self.resolution = np.floor(extent / self.cellSize).astype(np.int64) + 1
+        self.numBits = int(self.resolution.max() - 1).bit_length()
+
+        cells = self._cellCoords(self.points)
+        keys = self._cellKeys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.sortedPoints = self.points[self.order]
+
+        self._buildLevels(keys[self.order], cells[self.order])
+
+        # Cells larger than asked for can hold a whole cluster, they get
+        # their own finer grid on the first query that reaches them
+        self.denseCells = np.zeros(0, dtype=np.int64)
+        if self.cellSize > cellSize:
+            self.denseCells = np.flatnonzero(
+                np.diff(self.levelStarts[0]) > self.maxCellPoints)
+        self._denseIndices = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def _getCellSize(self, extent, pointsPerCell):
+        numPoints = len(self.points)
+
+        # Size cells from the bulk of the points so a few outliers
+        # don't stretch the cells over the dense region
+        if numPoints:
+            low, high = np.percentile(self.points, [1, 99], axis=0)
+            bulkExtent = high - low
+        else:
+            bulkExtent = extent
+
+        active = bulkExtent > 0
+        if np.any(active):
+            volume = np.prod(bulkExtent[active])
+            return (volume * pointsPerCell / numPoints) \
+                ** (1.0 / np.count_nonzero(active))
+
+        return float(extent.max()) or 1.0
+
+    def _buildLevels(self, keys, cells):
+        """ Occupied cells of the grid and of every coarser grid
+
+            Cell i of level l has the coordinates levelCells[l][i] in
+            cells levelSizes[l] large, owns the sorted points
+            levelStarts[l][i]:levelStarts[l][i + 1] and, above level 0,
+            the cells levelChildren[l][i]:levelChildren[l][i + 1] of
+            level l - 1.
+
+            Args:
+                keys: sorted cell key of every point
+                cells: cell coordinates of every sorted point
+        """
+
+        isStart = np.ones(len(keys), dtype=bool)
+        isStart[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(isStart)
+        keys = keys[starts]
+        self.occupiedKeys = keys
+
+        self.levelSizes = [self.cellSize]
+        self.levelCells = [cells[starts]]
+        self.levelStarts = [np.append(starts, len(self.points))]
+        self.levelChildren = [None]
+
+        while len(keys) > 1:
+            keys = keys >> self.dim
+            isStart = np.ones(len(keys), dtype=bool)
+            isStart[1:] = keys[1:] != keys[:-1]
+            children = np.flatnonzero(isStart)
+            keys = keys[children]
+
+            self.levelSizes.append(self.levelSizes[-1] * 2)
+            self.levelCells.append(self.levelCells[-1][children] >> 1)
+            self.levelStarts.append(np.append(
+                self.levelStarts[-1][children], len(self.points)))
+            self.levelChildren.append(
+                np.append(children, len(self.levelCells[-2])))
+
+    def _cellCoords(self, points):
+        cells = np.floor((points - self.origin) / self.cellSize)
+        return np.clip(cells, 0, self.resolution - 1).astype(np.int64)
+
+    def _cellKeys(self, cells):
+        """ Z-order keys, cells of coarser grids are key ranges """
+
+        # Bits of every byte spread dim - 1 bits apart
+        spread = np.zeros(256, dtype=np.int64)
+        for bit in range(8):
+            spread |= ((np.arange(256) >> bit) & 1) << (bit * self.dim)
+
+        keys = np.zeros(len(cells), dtype=np.int64)
+        for byte in range(0, self.numBits, 8):
+            for axis in range(self.dim):
+                keys |= spread[(cells[:, axis] >> byte) & 255] \
+                    << (byte * self.dim + axis)
+        return keys
+
+    def _blockOffsets(self, ring):
+        axes = [np.arange(-ring, ring + 1)] * self.dim
+        grids = np.meshgrid(*axes, indexing="ij")
+        return np.stack([i.ravel() for i in grids], axis=1)
+
+    def _blockCells(self, cells, ring):
+        """ Occupied cells of the (2 * ring + 1) ** dim block around cells
+
+            Returns:
+                (query index, cell index) per occupied cell, sorted by query
+        """
+
+        offsets = self._blockOffsets(ring)
+        neighbours = cells[:, None, :] + offsets[None, :, :]
+        valid = np.all(
+            (neighbours >= 0) & (neighbours < self.resolution), axis=2)
+
+        queryIds = np.nonzero(valid)[0]
+        keys = self._cellKeys(neighbours[valid])
+        cellIds = np.searchsorted(self.occupiedKeys, keys)
+        cellIds = np.minimum(cellIds, len(self.occupiedKeys) - 1)
+
+        occupied = self.occupiedKeys[cellIds] == keys
+        return queryIds[occupied], cellIds[occupied]
+
+    def _nearest(self, points, queryIds, positions, numQueries, k):
+        """ k smallest candidate distances per query
+
+            Candidates have to be grouped by query, queryIds sorted.
+        """
+
+        delta = self.sortedPoints[positions] - points[queryIds]
+        candidateDistances = np.sqrt(np.einsum("ij,ij->i", delta, delta))
+
+        if k == 1:
+            return self._nearestOne(
+                queryIds, positions, candidateDistances, numQueries)
+
+        # Segmented k smallest: sort by (query, distance)
+        sortOrder = np.lexsort((candidateDistances, queryIds))
+        queryIds = queryIds[sortOrder]
+        positions = positions[sortOrder]
+        candidateDistances = candidateDistances[sortOrder]
+
+        counts = np.bincount(queryIds, minlength=numQueries)
+        starts = np.zeros(numQueries + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        rank = np.arange(len(queryIds)) - starts[queryIds]
+        keep = rank < k
+
+        distances = np.full((numQueries, k), np.inf)
+        indices = np.full((numQueries, k), len(self.points), dtype=np.int64)
+        distances[queryIds[keep], rank[keep]] = candidateDistances[keep]
+        indices[queryIds[keep], rank[keep]] = self.order[positions[keep]]
+
+        return distances, indices
+
+    def _nearestOne(self, queryIds, positions, candidateDistances, numQueries):
+        distances = np.full((numQueries, 1), np.inf)
+        indices = np.full((numQueries, 1), len(self.points), dtype=np.int64)
+
+        if len(queryIds) == 0:
+            return distances, indices
+
+        # Segment minimum without sorting the candidates
+        segmentStarts = np.flatnonzero(
+            np.concatenate(([True], queryIds[1:] != queryIds[:-1])))
+        segmentQueries = queryIds[segmentStarts]
+        minimums = np.minimum.reduceat(candidateDistances, segmentStarts)
+
+        segmentIds = np.cumsum(
+            np.concatenate(([0], queryIds[1:] != queryIds[:-1])))
+        isMinimum = np.flatnonzero(
+            candidateDistances == minimums[segmentIds])
+        _, first = np.unique(segmentIds[isMinimum], return_index=True)
+
+        distances[segmentQueries, 0] = minimums
+        indices[segmentQueries, 0] = self.order[positions[isMinimum[first]]]
+
+        return distances, indices
+
+    def _getDenseIndex(self, cellId):
+        # type: (int) -> GridIndex
+
+        if cellId not in self._denseIndices:
+            first, last = self.levelStarts[0][cellId:cellId + 2]
+            self._denseIndices[cellId] = GridIndex(
+                self.sortedPoints[first:last], self.pointsPerCell)
+        return self._denseIndices[cellId]
+
+    def _cellRanges(self, points, queryIds, cellIds, k):
+        """ Point ranges to search for (query, cell) pairs
+
+            A dense cell is replaced by the k nearest points of its own
+            grid, k ranges of at most one point.
+        """
+
+        starts = self.levelStarts[0][cellIds]
+        ends = self.levelStarts[0][cellIds + 1]
+
+        if len(self.denseCells) == 0:
+            return queryIds, starts, ends
+
+        dense = np.isin(cellIds, self.denseCells)
+        if not dense.any():
+            return queryIds, starts, ends
+
+        repeats = np.where(dense, k, 1)
+        slots = np.cumsum(repeats) - repeats
+        denseStarts = np.repeat(starts, repeats)
+        denseEnds = np.repeat(ends, repeats)
+
+        denseRows = np.flatnonzero(dense)
+        for cellId in np.unique(cellIds[denseRows]):
+            rows = denseRows[cellIds[denseRows] == cellId]
+            index = self._getDenseIndex(cellId)
+            _, found = index._search(points[queryIds[rows]], k, np.inf)
+
+            rowSlots = slots[rows][:, None] + np.arange(k)
+            rowStarts = starts[rows][:, None] + found
+            denseStarts[rowSlots] = rowStarts
+            denseEnds[rowSlots] = np.where(
+                found < len(index), rowStarts + 1, rowStarts)
+
+        return np.repeat(queryIds, repeats), denseStarts, denseEnds
+
+    def _searchCells(self, points, queryIds, cellIds, k):
+        """ k nearest points of (query, cell) pairs sorted by query """
+
+        numQueries = len(points)
+        distances = np.full((numQueries, k), np.inf)
+        indices = np.full((numQueries, k), len(self.points), dtype=np.int64)
+
+        if numQueries == 0:
+            return distances, indices
+
+        queryIds, starts, ends = self._cellRanges(points, queryIds, cellIds, k)
+        lengths = ends - starts
+
+        # Split the queries so each batch stays within the budget
+        perQuery = np.bincount(queryIds, weights=lengths, minlength=numQueries)
+        batches = (np.cumsum(perQuery) - perQuery) // self.candidateBudget
+        bounds = np.concatenate(
+            ([0], np.flatnonzero(np.diff(batches)) + 1, [numQueries]))
+
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first == last:
+                continue
+
+            lo, hi = np.searchsorted(queryIds, [first, last])
+            positions, rangeIds = expandRanges(starts[lo:hi], ends[lo:hi])
+
+            distances[first:last], indices[first:last] = self._nearest(
+                points[first:last],
+                queryIds[lo:hi][rangeIds] - first,
+                positions,
+                last - first,
+                k)
+
+        return distances, indices
+
+    def _searchBlock(self, points, cells, ring, k):
+        numQueries = len(points)
+        distances = np.full((numQueries, k), np.inf)
+        indices = np.full((numQueries, k), len(self.points), dtype=np.int64)
+
+        # Every query enumerates the whole block, split the queries
+        batchSize = max(self.candidateBudget // (2 * ring + 1) ** self.dim, 1)
+
+        for first in range(0, numQueries, batchSize):
+            last = min(first + batchSize, numQueries)
+            queryIds, cellIds = self._blockCells(cells[first:last], ring)
+            distances[first:last], indices[first:last] = self._searchCells(
+                points[first:last], queryIds, cellIds, k)
+
+        return distances, indices
+
+    def _searchedRadius(self, points, cells, ring):
+        """ Distance from each query to the grid outside of its block
+
+            Every point closer than this lies inside the searched block.
+        """
+
+        lower = self.origin
+        upper = self.origin + self.resolution * self.cellSize
+        blockLower = self.origin + (cells - ring) * self.cellSize
+        blockUpper = self.origin + (cells + ring + 1) * self.cellSize
+
+        radius = np.full(len(points), np.inf)
+
+        # The rest of the grid is a box beyond each face of the block
+        for axis in range(self.dim):
+            for isUpper in (False, True):
+                boxLower = np.broadcast_to(lower, points.shape).copy()
+                boxUpper = np.broadcast_to(upper, points.shape).copy()
+                if isUpper:
+                    boxLower[:, axis] = blockUpper[:, axis]
+                    valid = blockUpper[:, axis] < upper[axis]
+                else:
+                    boxUpper[:, axis] = blockLower[:, axis]
+                    valid = blockLower[:, axis] > lower[axis]
+
+                gap = np.maximum(boxLower - points, 0.0) \
+                    + np.maximum(points - boxUpper, 0.0)
+                distance = np.sqrt(np.einsum("ij,ij->i", gap, gap))
+                radius[valid] = np.minimum(radius[valid], distance[valid])
+
+        return radius
+
+    def _getRing(self, limits, outside):
+        """ Ring whose block contains every point within limits
+
+            A point at distance d from a query outside the grid is at most
+            sqrt(d ** 2 - outside ** 2) away from the clamped query.
+        """
+
+        reach = np.sqrt(np.maximum(limits * limits - outside, 0.0))
+        return np.ceil(reach / self.cellSize)
+
+    def _descend(self, points, k, bounds):
+        """ Exact k nearest points from the top of the pyramid
+            Args:
+                points: (M, dim) query points
+                k: number of neighbours
+                bounds: (M,) known upper bound of the k-th distance of
+                        each query, inf if unknown
+
+            Returns:
+                (M, k) distances and indices
+        """
+
+        numQueries = len(points)
+        distances = np.full((numQueries, k), np.inf)
+        indices = np.full((numQueries, k), len(self.points), dtype=np.int64)
+
+        # Every query keeps a few cells per level, split the queries
+        batchSize = max(self.candidateBudget >> 10, 1)
+
+        for first in range(0, numQueries, batchSize):
+            last = min(first + batchSize, numQueries)
+            distances[first:last], indices[first:last] = self._descendBatch(
+                points[first:last], k, bounds[first:last])
+
+        return distances, indices
+
+    def _descendBatch(self, points, k, bounds):
+        numQueries = len(points)
+
+        top = len(self.levelCells) - 1
+        numTop = len(self.levelCells[top])
+        queryIds = np.repeat(np.arange(numQueries), numTop)
+        cellIds = np.tile(np.arange(numTop), numQueries)
+
+        for level in range(top, 0, -1):
+            children = self.levelChildren[level]
+            cellIds, rangeIds = expandRanges(
+                children[cellIds], children[cellIds + 1])
+            queryIds = queryIds[rangeIds]
+            queryPoints = points[queryIds]
+
+            # The first point of every cell is a real point, the k-th
+            # closest of them bounds the k-th distance
+            delta = self.sortedPoints[
+                self.levelStarts[level - 1][cellIds]] - queryPoints
+            firstDistances = np.sqrt(np.einsum("ij,ij->i", delta, delta))
+            bounds = np.minimum(bounds, kthSmallest(
+                queryIds, firstDistances, numQueries, k))
+
+            # Drop cells whose box is further than the bound
+            size = self.levelSizes[level - 1]
+            lower = self.origin + self.levelCells[level - 1][cellIds] * size
+            gap = np.maximum(lower - queryPoints, 0.0) \
+                + np.maximum(queryPoints - (lower + size), 0.0)
+            boxDistances = np.sqrt(np.einsum("ij,ij->i", gap, gap))
+
+            keep = boxDistances <= bounds[queryIds]
+            queryIds = queryIds[keep]
+            cellIds = cellIds[keep]
+
+        return self._searchCells(points, queryIds, cellIds, k)
+
+    def _search(self, points, k, distanceUpperBound):
+        """ Exact k nearest points, (M, k) distances and indices """
+
+        numQueries = len(points)
+        distances = np.full((numQueries, k), np.inf)
+        indices = np.full((numQueries, k), len(self.points), dtype=np.int64)
+
+        if numQueries == 0 or len(self.points) == 0:
+            return distances, indices
+
+        cells = self._cellCoords(points)
+
+        # Squared distance of queries outside the grid to the grid
+        gap = np.maximum(self.origin - points, 0.0) + np.maximum(
+            points - (self.origin + self.resolution * self.cellSize), 0.0)
+        outside = np.einsum("ij,ij->i", gap, gap)
+
+        limits = np.full(numQueries, float(distanceUpperBound))
+
+        maxRing = int(self.resolution.max())
+        largestRing = 1
+        while (2 * largestRing + 3) ** self.dim <= self.maxBlockCells:
+            largestRing += 1
+
+        rings = np.ones(numQueries)
+        resolved = np.zeros(numQueries, dtype=bool)
+        pending = np.arange(numQueries)
+
+        while len(pending):
+            for ring in np.unique(rings[pending]):
+                group = pending[rings[pending] == ring]
+                ring = int(ring)
+
+                found, foundIds = self._searchBlock(
+                    points[group], cells[group], ring, k)
+
+                radius = self._searchedRadius(points[group], cells[group], ring)
+                done = (found[:, -1] <= radius) | (limits[group] <= radius)
+
+                distances[group[done]] = found[done]
+                indices[group[done]] = foundIds[done]
+                resolved[group[done]] = True
+
+                # Candidates found so far bound the k-th distance
+                unresolved = group[~done]
+                limits[unresolved] = np.minimum(
+                    limits[unresolved], found[~done, -1])
+
+                needed = self._getRing(limits[unresolved], outside[unresolved])
+                rings[unresolved] = np.minimum(
+                    np.maximum(needed, ring + 1), maxRing)
+
+            pending = pending[~resolved[pending]]
+
+            # Queries that found nothing or would need a larger block go
+            # down the pyramid, it skips empty cells
+            deep = pending[rings[pending] > largestRing]
+            if len(deep):
+                distances[deep], indices[deep] = self._descend(
+                    points[deep], k, limits[deep])
+                pending = pending[rings[pending] <= largestRing]
+
+        return distances, indices
+
+    def query(self, points, k=1, distanceUpperBound=np.inf):
+        # type: (np.ndarray, int, float) -> tuple
+        """ Find the k nearest points for every query point
+            Args:
+                points: (M, dim) query points
+                k: number of neighbours
+                distanceUpperBound: ignore neighbours further than this
+
+            Returns:
+                (distances, indices), (M,) arrays for k == 1 otherwise (M, k)
+        """
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.dim)
+
+        distances, indices = self._search(points, k, distanceUpperBound)
+
+        beyond = distances > distanceUpperBound
+        distances[beyond] = np.inf
+        indices[beyond] = len(self.points)
+
+        if k == 1:
+            return distances[:, 0], indices[:, 0]
+        return distances, indices
+
+
+class KDTreeIndex(object):
+    """ scipy cKDTree backend """
+
+    def __init__(self, points):
+        # type: (np.ndarray) -> None
+
+        if cKDTree is None:
+            raise ImportError("scipy is not installed")
+
+        self.points = np.asarray(points, dtype=np.float64)
+        self.tree = cKDTree(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, points, k=1, distanceUpperBound=np.inf):
+        # type: (np.ndarray, int, float) -> tuple
+        """ Find the k nearest points for every query point, see GridIndex """
+
+        points = np.asarray(points, dtype=np.float64)
+        return self.tree.query(
+            points, k=k, distance_upper_bound=distanceUpperBound)
+
+
+def createIndex(points, backend="auto"):
+    # type: (np.ndarray, str) -> object
+    """ Build a nearest neighbour index
+        Args:
+            points: (N, dim) points
+            backend: 'grid', 'kdtree' or 'auto' to use kdtree if scipy
+                     is installed
+
+        Returns:
+            GridIndex or KDTreeIndex
+    """
+
+    if backend == "auto":
+        backend = "kdtree" if cKDTree is not None else "grid"
+
+    if backend == "kdtree":
+        return KDTreeIndex(points)
+    elif backend == "grid":
+        return GridIndex(points)
+
+    raise ValueError("unknown backend: {}".format(backend))
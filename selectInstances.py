@@ -2,37 +2,317 @@ from maya import cmds
 from maya.api import OpenMaya
 
 
-def getInstances(path: str):
+def getNode(node) -> OpenMaya.MObject:
+    """ MObject from a node name, MDagPath or MObject """
+
+    if isinstance(node, OpenMaya.MObject):
+        return node
+    if isinstance(node, OpenMaya.MDagPath):
+        return node.node()
+
     sel = OpenMaya.MSelectionList()
-    sel.add(path)
-    dagPath = sel.getDagPath(0)
+    sel.add(node)
+    return sel.getDependNode(0)
 
-    objs = []
 
-    itDag = OpenMaya.MItDag()
-    itDag.reset(dagPath, OpenMaya.MItDag.kBreadthFirst)
+class InstanceIndex(object):
+    """ Instanced dag nodes and their paths, built in one traversal
+
+        Nodes are keyed by MObjectHandle hash codes and compared by handle,
+        no path strings are built until they are asked for. Nodes below an
+        instanced parent are indirectly instanced and are indexed as well.
+        The primary instance of a node is the path with instance number 0.
+
+        With watch() the index follows dag changes through callbacks.
+        Changed nodes are only recorded, their subtrees are patched on the
+        next query. rebuild() starts over from a full traversal.
+    """
+
+    def __init__(self, root: str = None):
+        """
+            Args:
+                root: only index nodes under this dag node, whole scene if None
+        """
+
+        self.root = root
+        self.rootPath = None
+
+        # hash code -> [[MObjectHandle, [MDagPath, ...]], ...]
+        self._entries = {}
+
+        # Nodes changed since the last query, hash code -> [MObjectHandle]
+        self._dirty = {}
+        self._needsRebuild = False
+        self._callbacks = []
+
+        self.build()
+
+    def build(self):
+        """ Rebuild the index from scratch """
+
+        self._entries = {}
+        self._dirty = {}
+        self._needsRebuild = False
+
+        itDag = OpenMaya.MItDag()
+        if self.root is not None:
+            sel = OpenMaya.MSelectionList()
+            sel.add(self.root)
+            rootPath = sel.getDagPath(0)
+            self.rootPath = rootPath.fullPathName()
+            itDag.reset(rootPath, OpenMaya.MItDag.kDepthFirst)
+
+        fnDag = OpenMaya.MFnDagNode()
+
+        # Instanced nodes are visited once per path
+        while not itDag.isDone():
+            fnDag.setObject(itDag.currentItem())
+            if fnDag.isInstanced():
+                self._add(itDag.currentItem(), itDag.getPath())
+            itDag.next()
+
+    rebuild = build
+
+    def watch(self):
+        """ Keep the index up to date with dag and scene callbacks """
+
+        if self._callbacks:
+            return
+
+        self._callbacks.append(
+            OpenMaya.MDagMessage.addAllDagChangesCallback(self._onDagChange))
+        for message in (
+                OpenMaya.MSceneMessage.kAfterNew,
+                OpenMaya.MSceneMessage.kAfterOpen,
+                OpenMaya.MSceneMessage.kAfterImport):
+            self._callbacks.append(OpenMaya.MSceneMessage.addCallback(
+                message, self._onSceneChange))
+
+    def stopWatching(self):
+        if self._callbacks:
+            OpenMaya.MMessage.removeCallbacks(self._callbacks)
+        self._callbacks = []
+
+    def _onDagChange(self, msgType, child, parent, *args):
+        # Child added/removed/reordered and instance added/removed.
+        # Only record the node, patching happens on the next query.
+        try:
+            node = child.node()
+        except RuntimeError:
+            self._needsRebuild = True
+            return
+
+        # Every node is recorded once until the next query
+        handle = OpenMaya.MObjectHandle(node)
+        handles = self._dirty.setdefault(handle.hashCode(), [])
+        if not any(i == handle for i in handles):
+            handles.append(handle)
+
+    def _onSceneChange(self, *args):
+        self._needsRebuild = True
+
+    def _underRoot(self, dagPath: OpenMaya.MDagPath) -> bool:
+        if self.rootPath is None:
+            return True
+        name = dagPath.fullPathName()
+        return name == self.rootPath or name.startswith(self.rootPath + "|")
+
+    def _remove(self, node: OpenMaya.MObject):
+        handle = OpenMaya.MObjectHandle(node)
+        entries = self._entries.get(handle.hashCode())
+        if not entries:
+            return
+        entries[:] = [i for i in entries if not i[0] == handle]
+        if not entries:
+            del self._entries[handle.hashCode()]
+
+    def _refresh(self, node: OpenMaya.MObject):
+        """ Re-index a single node from all of its current paths """
+
+        self._remove(node)
+
+        if not OpenMaya.MFnDagNode(node).isInstanced():
+            return
+
+        for dagPath in OpenMaya.MDagPath.getAllPathsTo(node):
+            if self._underRoot(dagPath):
+                self._add(node, dagPath)
+
+    def update(self):
+        """ Patch the subtrees of nodes changed since the last query """
+
+        if self._needsRebuild:
+            self.build()
+            return
+
+        if not self._dirty:
+            return
+
+        dirty = [i for handles in self._dirty.values() for i in handles]
+        self._dirty = {}
+
+        # Deleted nodes, including descendants of deleted nodes
+        for hashCode in list(self._entries):
+            entries = [i for i in self._entries[hashCode] if i[0].isValid()]
+            if entries:
+                self._entries[hashCode] = entries
+            else:
+                del self._entries[hashCode]
+
+        itDag = OpenMaya.MItDag()
+        fnDag = OpenMaya.MFnDagNode()
 
-    fnDag = OpenMaya.MFnDagNode()
+        # hash code -> [MObjectHandle], instanced nodes show up once per path
+        visited = {}
 
-    while not itDag.isDone():
-        fnDag.setObject(itDag.currentItem())
-        if fnDag.isInstanced():
-            mObj = fnDag.parent(0)
-            p = OpenMaya.MFnDagNode(mObj)
+        for handle in dirty:
+            if not handle.isValid():
+                continue
 
-            dataParent = p.fullPathName()
-            dagPath2 = itDag.getPath()
-            dagPath2.pop(1)
-            hierarchyParent = dagPath2.fullPathName()
+            # Paths of everything below a changed node may have changed
+            itDag.reset(handle.object(), OpenMaya.MItDag.kDepthFirst)
+            while not itDag.isDone():
+                node = itDag.currentItem()
+                nodeHandle = OpenMaya.MObjectHandle(node)
+                key = nodeHandle.hashCode()
+                fnDag.setObject(node)
 
-            if dataParent != hierarchyParent:
-                objs.append(hierarchyParent)
+                seen = visited.setdefault(key, [])
+                if not any(i == nodeHandle for i in seen):
+                    seen.append(nodeHandle)
+                    if fnDag.isInstanced() or self._find(node) is not None:
+                        self._refresh(node)
+                itDag.next()
 
-        itDag.next()
+    def _find(self, node: OpenMaya.MObject) -> list:
+        handle = OpenMaya.MObjectHandle(node)
+        for entry in self._entries.get(handle.hashCode(), ()):
+            if entry[0] == handle:
+                return entry
+        return None
+
+    def _add(self, node: OpenMaya.MObject, dagPath: OpenMaya.MDagPath):
+        entry = self._find(node)
+        if entry is None:
+            handle = OpenMaya.MObjectHandle(node)
+            entry = [handle, []]
+            self._entries.setdefault(handle.hashCode(), []).append(entry)
+        entry[1].append(OpenMaya.MDagPath(dagPath))
+
+    def __len__(self):
+        self.update()
+        return sum(len(i) for i in self._entries.values())
+
+    def __iter__(self):
+        """ (MObject, list of MDagPath) of every instanced node """
+
+        self.update()
+
+        for entries in self._entries.values():
+            for handle, paths in entries:
+                if handle.isValid():
+                    yield handle.object(), paths
+
+    def getPaths(self, node) -> list:
+        """ All indexed paths of an instanced node, empty if not instanced """
+
+        self.update()
+
+        entry = self._find(getNode(node))
+        return list(entry[1]) if entry is not None else []
+
+    def getCount(self, node) -> int:
+        """ Number of indexed instances of a node """
+
+        self.update()
+
+        entry = self._find(getNode(node))
+        return len(entry[1]) if entry is not None else 0
+
+    def isInstanced(self, node) -> bool:
+        self.update()
+        return self._find(getNode(node)) is not None
+
+    @staticmethod
+    def isPrimary(dagPath: OpenMaya.MDagPath) -> bool:
+        return dagPath.instanceNumber() == 0
+
+    def getPrimary(self, node) -> OpenMaya.MDagPath:
+        """ Primary path of an instanced node, None if not indexed """
+
+        for dagPath in self.getPaths(node):
+            if self.isPrimary(dagPath):
+                return dagPath
+        return None
+
+    def getSecondary(self, node=None) -> list:
+        """ Non-primary paths of a node, or of every indexed node """
+
+        if node is not None:
+            return [i for i in self.getPaths(node) if not self.isPrimary(i)]
+
+        return [
+            dagPath
+            for _, paths in self
+            for dagPath in paths
+            if not self.isPrimary(dagPath)]
+
+    def getCounts(self) -> dict:
+        """ Instance count per instanced node full path name """
+
+        return dict(
+            (OpenMaya.MFnDagNode(node).fullPathName(), len(paths))
+            for node, paths in self)
+
+
+def getInstances(path: str, index: InstanceIndex = None):
+    """ Parents of all non-primary instances under a root, including
+        nodes that are only instanced through an instanced parent
+        Args:
+            path: root dag node
+            index: reuse an existing index of the root
+
+        Returns:
+            List of full path names
+    """
+
+    if index is None:
+        index = InstanceIndex(path)
+
+    objs = []
+    for dagPath in index.getSecondary():
+        parentPath = OpenMaya.MDagPath(dagPath)
+        parentPath.pop(1)
+        objs.append(parentPath.fullPathName())
 
     return objs
 
 
+def getIndex(root: str) -> InstanceIndex:
+    """ Watched index of a root, built on the first call only """
+
+    index = _indices.get(root)
+    if index is None:
+        index = InstanceIndex(root)
+        index.watch()
+        _indices[root] = index
+    return index
+
+
+def clearIndices():
+    """ Stop all callbacks of the indices kept by getIndex """
+
+    for index in _indices.values():
+        index.stopWatching()
+    _indices.clear()
+
+
+# Remove the callbacks of the previous import when the module is reloaded
+if "_indices" in globals():
+    clearIndices()
+_indices = {}
+
+
 def main(select=True):
     root = cmds.ls(sl=True, fl=True, long=True)
 
@@ -41,7 +321,7 @@ def main(select=True):
     else:
         root = root[0]
 
-    instances = getInstances(root)
+    instances = getInstances(root, getIndex(root))
     if select:
         cmds.select(instances, r=True)
 
@@ -1,59 +1,525 @@
-from maya.api import OpenMaya
-from maya import cmds
+""" Separate polygons by uv shells
+
+Two modes:
+    detach: detach uv border edges and run SeparatePolygon
+    direct: build one new mesh per uv shell from the source arrays with
+            MFnMesh.create, no construction history
+
+The direct mode reads every selected mesh up front, partitions them in a
+process pool and then creates all result meshes.
+
+Requirement: https://github.com/mottosso/apiundo (direct mode)
+"""
+
 import time
 
-class UVShell():
-    def __init__(self, shellIndex, dagPath):
-        self.uvIndices = []
-        self.shellIndex = shellIndex
-        self.dagPath = dagPath
-        self.fullPathList = []
-    
-    def setPath(self):
-        for i in self.uvIndices:
-            path = self.dagPath + ".map[%s]" % i
-            self.fullPathList.append(path)
-                 
-def selectTextureBorderEdges(obj):
-    sel = OpenMaya.MSelectionList()
-    sel.add(obj)
-    dagPath = sel.getDagPath(0)
+import numpy as np
+
+try:
+    from maya.api import OpenMaya
+    from maya import cmds
+    import componentSelection
+except ImportError:
+    # Pool workers only run the numpy partitioning
+    OpenMaya = None
+
+from uvResizer import meshArea
+from uvResizer import meshData
+from uvResizer import uvTransform
+from uvResizer import workerPool
+
+
+def getEdgeVertices(dagPath):
+    # type: (OpenMaya.MDagPath) -> np.ndarray
+    """ Vertex pair of every edge in one iterator pass
+        Args:
+            dagPath: mesh dag path
+
+        Returns:
+            (E, 2) vertex ids, row i is edge i
+    """
+
+    itEdge = OpenMaya.MItMeshEdge(dagPath)
+    vertices = []
+    while not itEdge.isDone():
+        vertices.append(itEdge.vertexId(0))
+        vertices.append(itEdge.vertexId(1))
+        itEdge.next()
+
+    return np.array(vertices, dtype=np.int64).reshape(-1, 2)
+
+
+def findBorderEdges(data, edgeVertices):
+    # type: (meshData.MeshData, np.ndarray) -> np.ndarray
+    """ Edges on uv borders
+        An edge is a border when the face-sides sharing it have different
+        uv ids on either end. Different shells never share uv ids so shell
+        borders are always included. Open mesh edges are not borders.
+
+        Args:
+            data: MeshData
+            edgeVertices: (E, 2) vertex ids of every edge
+
+        Returns:
+            Border edge ids
+    """
+
+    numVertices = max(len(data.points), 1)
+
+    # Face-sides, from every face-vertex to the next one in its face
+    starts = np.repeat(data.faceOffsets[:-1], data.polygonCounts)
+    counts = np.repeat(data.polygonCounts, data.polygonCounts)
+    current = np.arange(len(data.polygonConnects))
+    following = starts + (current - starts + 1) % counts
+
+    a = data.polygonConnects[current]
+    b = data.polygonConnects[following]
+    uvA = data.faceVertexUVs[current]
+    uvB = data.faceVertexUVs[following]
+
+    # Orient every side from its lower vertex so both sides of an edge
+    # compare the uvs of the same vertices
+    flip = a > b
+    uvA, uvB = np.where(flip, uvB, uvA), np.where(flip, uvA, uvB)
+    sideKeys = np.minimum(a, b) * numVertices + np.maximum(a, b)
+
+    edgeKeys = edgeVertices.min(axis=1) * numVertices \
+        + edgeVertices.max(axis=1)
+    edgeOrder = np.argsort(edgeKeys)
+    found = np.searchsorted(edgeKeys[edgeOrder], sideKeys)
+    sideEdges = edgeOrder[np.minimum(found, len(edgeOrder) - 1)]
+
+    # Compare every side with the first side of its edge
+    order = np.argsort(sideEdges, kind="stable")
+    sideEdges = sideEdges[order]
+    uvA = uvA[order]
+    uvB = uvB[order]
+
+    first = np.searchsorted(sideEdges, sideEdges, side="left")
+    differ = (uvA != uvA[first]) | (uvB != uvB[first])
+
+    return np.unique(sideEdges[differ])
+
+
+def getTextureBorderEdges(dagPath):
+    # type: (OpenMaya.MDagPath) -> np.ndarray
+    """ UV border edge ids of a mesh """
+
+    data = meshData.MeshData.fromDagPath(dagPath, OpenMaya.MSpace.kObject)
+    return findBorderEdges(data, getEdgeVertices(dagPath))
+
+
+class ShellPartition(object):
+    """ Source mesh split into pieces, one per uv shell
+
+        Arrays of all pieces are concatenated, piece i owns
+        faceIds[faceOffsets[i]:faceOffsets[i + 1]] and likewise for the
+        face-vertex, vertex and uv arrays. Faces without uvs make up the
+        last piece.
+    """
+
+    __slots__ = (
+        "name", "faceIds", "polygonCounts", "polygonConnects", "uvCounts",
+        "uvIds", "normals", "points", "uArray", "vArray", "faceOffsets",
+        "faceVertexOffsets", "vertexOffsets", "uvOffsets", "uvIdOffsets")
+
+    def __len__(self):
+        return len(self.faceOffsets) - 1
+
+    def piece(self, index):
+        # type: (int) -> dict
+        """ Arrays of a single piece, indices are local to the piece """
+
+        f0, f1 = self.faceOffsets[index:index + 2]
+        fv0, fv1 = self.faceVertexOffsets[index:index + 2]
+        v0, v1 = self.vertexOffsets[index:index + 2]
+        uv0, uv1 = self.uvOffsets[index:index + 2]
+        id0, id1 = self.uvIdOffsets[index:index + 2]
+
+        return {
+            "faceIds": self.faceIds[f0:f1],
+            "polygonCounts": self.polygonCounts[f0:f1],
+            "polygonConnects": self.polygonConnects[fv0:fv1],
+            "uvCounts": self.uvCounts[f0:f1],
+            "uvIds": self.uvIds[id0:id1],
+            "normals":
+                None if self.normals is None else self.normals[fv0:fv1],
+            "points": self.points[v0:v1],
+            "uArray": self.uArray[uv0:uv1],
+            "vArray": self.vArray[uv0:uv1]}
+
+
+def _offsets(groupIds, numGroups):
+    offsets = np.zeros(numGroups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groupIds, minlength=numGroups), out=offsets[1:])
+    return offsets
+
+
+def partitionByShell(data, normals=None):
+    # type: (meshData.MeshData, np.ndarray) -> ShellPartition
+    """ Partition faces by uv shell and remap vertex and uv indices
+        Args:
+            data: MeshData
+            normals: optional (FV, 3) face-vertex normals
+
+        Returns:
+            ShellPartition
+    """
+
+    numShells, shellIds = data.getUvShellIds()
+    faceShells = meshArea.faceShellIds(data, shellIds)
+    faceShells[faceShells < 0] = numShells
+
+    faceIds = np.argsort(faceShells, kind="stable")
+    _, pieceOfFace = np.unique(faceShells[faceIds], return_inverse=True)
+    numPieces = int(pieceOfFace.max()) + 1 if len(faceIds) else 0
+
+    polygonCounts = data.polygonCounts[faceIds]
+    faceVertexIds, _ = uvTransform.expandRanges(
+        data.faceOffsets[faceIds], data.faceOffsets[faceIds + 1])
+    faceVertexPieces = np.repeat(pieceOfFace, polygonCounts)
+
+    # Vertices shared by several pieces are duplicated, one per piece
+    numVertices = max(len(data.points), 1)
+    vertexKeys, connects = np.unique(
+        faceVertexPieces * numVertices + data.polygonConnects[faceVertexIds],
+        return_inverse=True)
+    vertexOffsets = _offsets(vertexKeys // numVertices, numPieces)
+    connects = connects.ravel() - vertexOffsets[faceVertexPieces]
+
+    faceVertexUVs = data.faceVertexUVs[faceVertexIds]
+    mapped = faceVertexUVs >= 0
+    numUVs = max(data.numUVs, 1)
+    uvKeys, uvIds = np.unique(
+        faceVertexPieces[mapped] * numUVs + faceVertexUVs[mapped],
+        return_inverse=True)
+    uvOffsets = _offsets(uvKeys // numUVs, numPieces)
+    uvIds = uvIds.ravel() - uvOffsets[faceVertexPieces[mapped]]
+
+    partition = ShellPartition()
+    partition.name = data.name
+    partition.faceIds = faceIds
+    partition.polygonCounts = polygonCounts
+    partition.polygonConnects = connects
+    partition.uvCounts = data.uvCounts[faceIds]
+    partition.uvIds = uvIds
+    partition.normals = None if normals is None else normals[faceVertexIds]
+    partition.points = data.points[vertexKeys % numVertices]
+    partition.uArray = data.uArray[uvKeys % numUVs]
+    partition.vArray = data.vArray[uvKeys % numUVs]
+    partition.faceOffsets = _offsets(pieceOfFace, numPieces)
+    partition.faceVertexOffsets = _offsets(faceVertexPieces, numPieces)
+    partition.vertexOffsets = vertexOffsets
+    partition.uvOffsets = uvOffsets
+
+    # uvIds only exist for face-vertices of faces with uvs
+    partition.uvIdOffsets = _offsets(faceVertexPieces[mapped], numPieces)
+
+    return partition
+
+
+def getFaceVertexNormals(dagPath):
+    # type: (OpenMaya.MDagPath) -> np.ndarray
+    """ Object space normal of every face-vertex """
+
+    fnMesh = OpenMaya.MFnMesh(dagPath)
+    normals = np.array(fnMesh.getNormals(), dtype=np.float64).reshape(-1, 3)
+    _, normalIds = fnMesh.getNormalIds()
+    return normals[meshData.toArray(normalIds, np.int64)]
+
+
+def getFaceShaders(dagPath):
+    # type: (OpenMaya.MDagPath) -> tuple
+    """ Shading engines of a mesh
+        Returns:
+            (shading engine MObjectArray, shading engine index per face,
+             -1 if none)
+    """
+
     fnMesh = OpenMaya.MFnMesh(dagPath)
-    nbUvShells, uvShellIds = fnMesh.getUvShellsIds()
-    uvShells = [UVShell(i, dagPath.fullPathName()) for i in range(nbUvShells)]
-
-    for n, i in enumerate(uvShellIds):
-        uvShells[i].uvIndices.append(n)
-        
-    for i in uvShells:
-        i.setPath()
-
-    edges = []
-
-    for s in uvShells:
-        cmds.select(s.fullPathList[0], r=True)
-        cmds.ConvertSelectionToUVShellBorder()
-        cmds.ConvertSelectionToVertices()
-        cmds.ConvertSelectionToContainedEdges()
-        shellBorderEdges = cmds.ls(sl=True, fl=True, long=True)
-        edges.extend(shellBorderEdges)
-        cmds.select(d=True)
-
-    return list(set(edges))
-
-
-def main():
-    sel = cmds.ls(sl=True, fl=True, long=True)
-    for i in sel:
-        edges = selectTextureBorderEdges(i)
-        cmds.select(edges, r=True)
-        cmds.DetachEdgeComponent(edges)
-        cmds.select(i, r=True)
+    shaders, faceShaders = fnMesh.getConnectedShaders(dagPath.instanceNumber())
+    return shaders, meshData.toArray(faceShaders, np.int64)
+
+
+def createShellMeshes(partition, parent, transformation=None, shaders=None):
+    # type: (ShellPartition, OpenMaya.MObject, OpenMaya.MTransformationMatrix, tuple) -> list
+    """ Create one mesh per piece of a partition
+        Args:
+            partition: ShellPartition
+            parent: parent node of the new transforms, kNullObj for world
+            transformation: transformation of every new transform
+            shaders: (shading engines, index per source face) to assign
+                     the source shading to the new meshes
+
+        Returns:
+            List of new transform MObjects
+    """
+
+    baseName = partition.name.rpartition("|")[2] or "polySurface"
+    fnDag = OpenMaya.MFnDagNode()
+    fnMesh = OpenMaya.MFnMesh()
+    transforms = []
+    members = {}
+
+    for i in range(len(partition)):
+        piece = partition.piece(i)
+
+        transform = fnDag.create(
+            "transform", "{}_shell{}".format(baseName, i), parent)
+        if transformation is not None:
+            OpenMaya.MFnTransform(transform).setTransformation(transformation)
+
+        shape = fnMesh.create(
+            OpenMaya.MPointArray(piece["points"].tolist()),
+            piece["polygonCounts"].tolist(),
+            piece["polygonConnects"].tolist(),
+            piece["uArray"].tolist(),
+            piece["vArray"].tolist(),
+            transform)
+        fnMesh.setName(fnDag.name() + "Shape")
+        fnMesh.assignUVs(
+            piece["uvCounts"].tolist(), piece["uvIds"].tolist())
+
+        if piece["normals"] is not None:
+            faceList = np.repeat(
+                np.arange(len(piece["polygonCounts"])),
+                piece["polygonCounts"])
+            fnMesh.setFaceVertexNormals(
+                OpenMaya.MVectorArray(piece["normals"].tolist()),
+                faceList.tolist(),
+                piece["polygonConnects"].tolist())
+
+        transforms.append(transform)
+
+        if shaders is None:
+            continue
+
+        # Whole mesh when the piece has one shader, faces otherwise
+        shapePath = OpenMaya.MDagPath.getAPathTo(shape)
+        pieceShaders = shaders[1][piece["faceIds"]]
+        for shader in np.unique(pieceShaders):
+            if shader < 0:
+                continue
+            selection = members.setdefault(shader, OpenMaya.MSelectionList())
+            if np.all(pieceShaders == shader):
+                selection.add(shapePath)
+                continue
+            fnComponent = OpenMaya.MFnSingleIndexedComponent()
+            component = fnComponent.create(OpenMaya.MFn.kMeshPolygonComponent)
+            fnComponent.addElements(
+                np.flatnonzero(pieceShaders == shader).tolist())
+            selection.add((shapePath, component))
+
+    # One assignment per shading engine
+    for shader, selection in members.items():
+        OpenMaya.MFnSet(shaders[0][int(shader)]).addMembers(selection)
+
+    return transforms
+
+
+def printTimings(title, timings):
+    # type: (str, list) -> None
+    """ Print (stage, seconds) pairs and the total """
+
+    print("{}:".format(title))
+    for stage, seconds in timings:
+        print("    {:<12} {:.3f}s".format(stage, seconds))
+    print("    {:<12} {:.3f}s".format("total", sum(i[1] for i in timings)))
+
+
+class SplitSource(object):
+    """ Everything read from a source mesh before partitioning """
+
+    __slots__ = ("dagPath", "data", "normals", "shaders")
+
+    def __init__(self, dagPath, keepNormals=True):
+        # type: (OpenMaya.MDagPath, bool) -> None
+
+        self.dagPath = OpenMaya.MDagPath(dagPath)
+        self.data = meshData.MeshData.fromDagPath(
+            dagPath, OpenMaya.MSpace.kObject, shells=True)
+        self.normals = getFaceVertexNormals(dagPath) if keepNormals else None
+        self.shaders = getFaceShaders(dagPath)
+
+
+def _partitionJob(job):
+    return partitionByShell(*job)
+
+
+def partitionMeshes(sources, processes=None):
+    # type: (list, int) -> list
+    """ Partition meshes by uv shell with a process pool
+        Args:
+            sources: List of SplitSource
+            processes: number of worker processes, cpu count if None.
+                       Runs in this process if no mayapy is found.
+
+        Returns:
+            List of ShellPartition, same order as sources
+    """
+
+    jobs = [(i.data, i.normals) for i in sources]
+
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = workerPool.getPool(processes)
+
+    if pool is None:
+        return list(map(_partitionJob, jobs))
+
+    try:
+        return pool.map(_partitionJob, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def createFromPartition(source, partition, group=True):
+    # type: (SplitSource, ShellPartition, bool) -> list
+    """ Create the meshes of a partitioned source mesh
+        Args:
+            source: SplitSource
+            partition: ShellPartition of the source
+            group: parent the new meshes under a new group
+
+        Returns:
+            List of new top level nodes, the group or the new transforms
+    """
+
+    transformPath = OpenMaya.MDagPath(source.dagPath)
+    if transformPath.hasFn(OpenMaya.MFn.kMesh):
+        transformPath.pop()
+
+    parent = OpenMaya.MFnDagNode(transformPath).parent(0)
+    if parent.hasFn(OpenMaya.MFn.kWorld):
+        parent = OpenMaya.MObject.kNullObj
+    transformation = OpenMaya.MFnTransform(transformPath).transformation()
+
+    if group:
+        parent = OpenMaya.MFnDagNode().create(
+            "transform",
+            transformPath.partialPathName() + "_shells",
+            parent)
+        OpenMaya.MFnTransform(parent).setTransformation(transformation)
+        transformation = None
+
+    transforms = createShellMeshes(
+        partition, parent, transformation, source.shaders)
+
+    return [parent] if group else transforms
+
+
+def splitByShells(dagPath, group=True, keepNormals=True):
+    # type: (OpenMaya.MDagPath, bool, bool) -> list
+    """ Create one new mesh per uv shell without history
+        Args:
+            dagPath: mesh dag path
+            group: parent the new meshes under a new group
+            keepNormals: copy the face-vertex normals, normals get locked
+
+        Returns:
+            List of new top level nodes, the group or the new transforms
+    """
+
+    source = SplitSource(dagPath, keepNormals)
+    partition = partitionByShell(source.data, source.normals)
+    return createFromPartition(source, partition, group)
+
+
+def splitSelected(group=True, keepNormals=True, processes=None):
+    # type: (bool, bool, int) -> list
+    """ Split selected meshes by uv shell, sources are hidden
+        Args:
+            group: parent the new meshes of each source under a group
+            keepNormals: copy the face-vertex normals
+            processes: number of worker processes for the partitioning
+
+        Returns:
+            List of created top level node names
+    """
+
+    # Only the direct mode needs apiundo
+    import apiundo
+
+    timings = []
+
+    t = time.time()
+    sources = [
+        SplitSource(i, keepNormals)
+        for i in componentSelection.getSelectedObjects()]
+    timings.append(("extract", time.time() - t))
+
+    t = time.time()
+    partitions = partitionMeshes(sources, processes)
+    timings.append(("partition", time.time() - t))
+
+    created = []
+
+    def doIt():
+        del created[:]
+        for source, partition in zip(sources, partitions):
+            nodes = createFromPartition(source, partition, group)
+            created.extend(OpenMaya.MObjectHandle(i) for i in nodes)
+            OpenMaya.MFnDagNode(source.dagPath).findPlug(
+                "visibility", False).setBool(False)
+
+    def undoIt():
+        modifier = OpenMaya.MDagModifier()
+        for handle in created:
+            if handle.isValid():
+                modifier.deleteNode(handle.object())
+        modifier.doIt()
+        for source in sources:
+            OpenMaya.MFnDagNode(source.dagPath).findPlug(
+                "visibility", False).setBool(True)
+
+    t = time.time()
+    doIt()
+    apiundo.commit(undo=lambda *args: undoIt(), redo=lambda *args: doIt())
+    timings.append(("create", time.time() - t))
+
+    printTimings("Split {} meshes into {} meshes".format(
+        len(sources), sum(len(i) for i in partitions)), timings)
+
+    names = [OpenMaya.MFnDagNode(i.object()).fullPathName() for i in created]
+    if names:
+        cmds.select(names, r=True)
+    return names
+
+
+def main(direct=False):
+    if direct:
+        splitSelected()
+        return
+
+    paths = componentSelection.getSelectedObjects()
+    sel = [i.fullPathName() for i in paths]
+    timings = [("borders", 0.0), ("detach", 0.0), ("separate", 0.0)]
+
+    for dagPath, name in zip(paths, sel):
+        t = time.time()
+        edges = getTextureBorderEdges(dagPath)
+        timings[0] = ("borders", timings[0][1] + time.time() - t)
+
+        # Detach all border edges at once
+        t = time.time()
+        if len(edges):
+            shapePath = OpenMaya.MDagPath(dagPath)
+            shapePath.extendToShape()
+            componentSelection.setSelection(
+                shapePath, componentSelection.EDGE, edges)
+            cmds.DetachEdgeComponent()
+        timings[1] = ("detach", timings[1][1] + time.time() - t)
+
+        t = time.time()
+        cmds.select(name, r=True)
         cmds.SeparatePolygon()
+        timings[2] = ("separate", timings[2][1] + time.time() - t)
 
     cmds.select(sel, r=True)
 
+    printTimings("Separated {} meshes".format(len(sel)), timings)
+
+
 if __name__ == "__main__":
-    t = time.time()
     main()
-    print time.time() - t
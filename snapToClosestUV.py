@@ -2,9 +2,15 @@
 
 """ Snap selected UVs to closest target UVs
 
+Several target meshes can be set at once. Snapping can be limited to a
+max distance and to uv shell border uvs, and the vertex mode snaps
+selected vertices to the closest target vertices in world space.
+
 Requirement:
-    kdtree: Copyright (c) Stefan Kögl <stefan@skoegl.net>
-    https://github.com/stefankoegl/kdtree
+    numpy
+    nearestNeighbor.py
+    scipy (optional): faster cKDTree backend
+    https://github.com/mottosso/apiundo (vertex mode)
 
 """
 
@@ -12,26 +18,158 @@ from PySide2 import QtWidgets, QtCore
 from maya.api import OpenMaya
 from maya import OpenMayaUI
 from maya import cmds
+import numpy as np
 import shiboken2
 import time
-import re
 
-try:
-    import kdtree
-except ImportError:
-    raise ImportError(
-        "KDTree is not installed. Download and install KDTree lib")
+import componentSelection
+import nearestNeighbor
+
+
+UV_MODE = "UV"
+VERTEX_MODE = "Vertex (world)"
 
 
-def createTree(mesh):
-    # type: (OpenMaya.MFnMesh) -> kdtree.KDNode
+def getUVs(mesh):
+    # type: (OpenMaya.MFnMesh) -> np.ndarray
+    """ All uvs of a mesh as a (N, 2) array """
 
     uArray, vArray = mesh.getUVs()
-    numUVs = mesh.numUVs()
-    points = [(uArray[i], vArray[i]) for i in range(numUVs)]
-    tree = kdtree.create(points, dimensions=2)
+    uvs = np.empty((len(uArray), 2), dtype=np.float64)
+    uvs[:, 0] = np.fromiter(uArray, dtype=np.float64, count=len(uArray))
+    uvs[:, 1] = np.fromiter(vArray, dtype=np.float64, count=len(vArray))
+    return uvs
+
+
+def getPoints(mesh, space=OpenMaya.MSpace.kWorld):
+    # type: (OpenMaya.MFnMesh, OpenMaya.MSpace) -> np.ndarray
+    """ All vertex positions of a mesh as a (N, 3) array """
+
+    points = mesh.getPoints(space)
+    if len(points) == 0:
+        return np.zeros((0, 3), dtype=np.float64)
+    return np.array(points, dtype=np.float64)[:, :3]
+
+
+def toObjectSpace(points, dagPath):
+    # type: (np.ndarray, OpenMaya.MDagPath) -> np.ndarray
+    """ World space (N, 3) positions in the object space of a mesh """
+
+    matrix = np.array(list(dagPath.inclusiveMatrixInverse())).reshape(4, 4)
+    return points.dot(matrix[:3, :3]) + matrix[3, :3]
+
+
+def setVertices(dagPath, indices, positions):
+    # type: (OpenMaya.MDagPath, np.ndarray, np.ndarray) -> None
+    """ Set object space positions of some vertices in one setPoints call
+    """
+
+    mesh = OpenMaya.MFnMesh(dagPath)
+    points = getPoints(mesh, OpenMaya.MSpace.kObject)
+    points[indices] = positions
+    mesh.setPoints(
+        OpenMaya.MPointArray(points.tolist()), OpenMaya.MSpace.kObject)
+
+
+def moveVertices(edits):
+    # type: (list) -> None
+    """ Set vertex positions with undo
+        Args:
+            edits: List of (dag path, vertex indices, old positions,
+                   new positions), positions in object space
+    """
+
+    # Only the vertex mode needs apiundo
+    import apiundo
+
+    def doIt():
+        for dagPath, indices, _, positions in edits:
+            setVertices(dagPath, indices, positions)
+
+    def undoIt():
+        for dagPath, indices, positions, _ in edits:
+            setVertices(dagPath, indices, positions)
+
+    doIt()
+    apiundo.commit(undo=lambda *args: undoIt(), redo=lambda *args: doIt())
+
+
+def getBorderUVIndices(mesh):
+    # type: (OpenMaya.MFnMesh) -> np.ndarray
+    """ UVs on uv shell borders
+
+        A uv edge is on a border when no other face uses the same pair of
+        uvs, either at a uv seam or at a mesh border.
+
+        Args:
+            mesh: MFnMesh
 
-    return tree
+        Returns:
+            Border uv indices
+    """
+
+    uvCounts, uvIds = mesh.getAssignedUVs()
+    uvCounts = np.array(uvCounts, dtype=np.int64)
+    uvIds = np.array(uvIds, dtype=np.int64)
+
+    if len(uvIds) == 0:
+        return uvIds
+
+    # Next face-vertex in the same face
+    offsets = np.repeat(np.cumsum(uvCounts) - uvCounts, uvCounts)
+    local = np.arange(len(uvIds)) - offsets
+    nextIds = uvIds[offsets + (local + 1) % np.repeat(uvCounts, uvCounts)]
+
+    low = np.minimum(uvIds, nextIds)
+    high = np.maximum(uvIds, nextIds)
+    keys = low * mesh.numUVs() + high
+    _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    border = first[counts == 1]
+
+    return np.unique(np.concatenate([low[border], high[border]]))
+
+
+def getTargetPoints(paths, mode=UV_MODE, borderOnly=False):
+    # type: (list, str, bool) -> np.ndarray
+    """ Snap target points of several meshes merged into one array
+        Args:
+            paths: target mesh paths
+            mode: UV_MODE or VERTEX_MODE
+            borderOnly: only uv shell border uvs, UV_MODE only
+
+        Returns:
+            (N, 2) uvs or (N, 3) world space positions
+    """
+
+    points = []
+
+    for path in paths:
+        mesh = getMesh(path)
+        if mode == VERTEX_MODE:
+            points.append(getPoints(mesh))
+        elif borderOnly:
+            points.append(getUVs(mesh)[getBorderUVIndices(mesh)])
+        else:
+            points.append(getUVs(mesh))
+
+    if not points:
+        return np.zeros((0, 3 if mode == VERTEX_MODE else 2))
+
+    return np.concatenate(points)
+
+
+def createTree(mesh, backend="auto"):
+    # type: (OpenMaya.MFnMesh, str) -> object
+    """ Build a nearest neighbour index over all uvs of a mesh
+        Args:
+            mesh: target mesh
+            backend: 'auto', 'grid' or 'kdtree', see nearestNeighbor
+
+        Returns:
+            nearestNeighbor index
+    """
+
+    return nearestNeighbor.createIndex(getUVs(mesh), backend)
 
 
 def getMesh(path):
@@ -46,7 +184,7 @@ def getMesh(path):
 
 def getMayaWindow():
     ptr = OpenMayaUI.MQtUtil.mainWindow()
-    return shiboken2.wrapInstance(long(ptr), QtWidgets.QMainWindow)
+    return shiboken2.wrapInstance(int(ptr), QtWidgets.QMainWindow)
 
 
 class Window(QtWidgets.QWidget):
@@ -64,55 +202,172 @@ class Window(QtWidgets.QWidget):
         self.setBtn.clicked.connect(self.setObject)
         self.snapBtn = QtWidgets.QPushButton("Snap")
         self.snapBtn.clicked.connect(self.snapIt)
+        self.backendCB = QtWidgets.QComboBox()
+        self.backendCB.addItems(["auto", "grid", "kdtree"])
+        self.modeCB = QtWidgets.QComboBox()
+        self.modeCB.addItems([UV_MODE, VERTEX_MODE])
+        self.borderCheckBox = QtWidgets.QCheckBox("Shell border only")
+
+        # 0 means no distance limit
+        self.distanceSB = QtWidgets.QDoubleSpinBox()
+        self.distanceSB.setDecimals(4)
+        self.distanceSB.setRange(0.0, 1000000.0)
+        self.distanceSB.setSingleStep(0.001)
+        self.distanceSB.setSpecialValueText("No limit")
+
+        formLayout = QtWidgets.QFormLayout()
+        formLayout.addRow("Mode", self.modeCB)
+        formLayout.addRow("Backend", self.backendCB)
+        formLayout.addRow("Max distance", self.distanceSB)
 
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.LE)
         layout.addWidget(self.setBtn)
+        layout.addLayout(formLayout)
+        layout.addWidget(self.borderCheckBox)
         layout.addWidget(self.snapBtn)
         self.setLayout(layout)
 
+        self.backendCB.currentIndexChanged.connect(self.invalidateTarget)
+        self.modeCB.currentIndexChanged.connect(self.invalidateTarget)
+        self.borderCheckBox.toggled.connect(self.invalidateTarget)
+
+        # Target index is kept between snaps until the targets change
+        self.targets = []
+        self.targetTree = None
+        self.targetMatrices = None
+        self.targetCallbacks = []
+
     def setObject(self):
 
-        sel = cmds.ls(sl=True, fl=True, long=True)
+        sel = cmds.ls(sl=True, objectsOnly=True, long=True)
 
         if sel:
-            self.LE.setText(sel[0])
+            self.targets = sel
+            self.LE.setText("; ".join(sel))
+            self.watchTargets(sel)
+            self.targetTree = self.getTargetTree()
+
+    def watchTargets(self, paths):
+        # type: (list) -> None
+        """ Invalidate the target index whenever a target mesh is dirtied
+        """
+
+        self.removeCallbacks()
+
+        for path in paths:
+            shapePath = OpenMaya.MDagPath(getMesh(path).dagPath())
+            shapePath.extendToShape()
+            self.targetCallbacks.append(
+                OpenMaya.MNodeMessage.addNodeDirtyCallback(
+                    shapePath.node(), self.invalidateTarget))
+
+    def removeCallbacks(self):
+        for i in self.targetCallbacks:
+            OpenMaya.MMessage.removeCallback(i)
+        self.targetCallbacks = []
+
+    def invalidateTarget(self, *args):
+        self.targetTree = None
+
+    def getTargetMatrices(self):
+        return [tuple(getMesh(i).dagPath().inclusiveMatrix())
+                for i in self.targets]
+
+    def getTargetTree(self):
+        """ Target index, only rebuilt when it was invalidated """
+
+        mode = self.modeCB.currentText()
+
+        # Moving a target doesn't dirty its shape, compare the matrices
+        matrices = None
+        if mode == VERTEX_MODE:
+            matrices = self.getTargetMatrices()
+            if matrices != self.targetMatrices:
+                self.targetTree = None
+
+        if self.targetTree is None:
+            points = getTargetPoints(
+                self.targets, mode, self.borderCheckBox.isChecked())
+            backend = self.backendCB.currentText()
+            try:
+                self.targetTree = nearestNeighbor.createIndex(points, backend)
+            except ImportError:
+                cmds.warning(
+                    "scipy is not installed, using the grid backend instead "
+                    "of {}".format(backend))
+                self.targetTree = nearestNeighbor.createIndex(points, "grid")
+            self.targetMatrices = matrices
+
+        return self.targetTree
+
+    def closeEvent(self, event):
+        self.removeCallbacks()
+        super(Window, self).closeEvent(event)
 
     def snapIt(self):
 
-        sel = cmds.ls(sl=True, fl=True)
+        mode = self.modeCB.currentText()
+        if mode == UV_MODE:
+            componentType = componentSelection.UV
+        else:
+            componentType = componentSelection.VERTEX
+
+        # Selected indices per mesh, never flattened
+        selected = componentSelection.getSelectedComponents(componentType)
 
-        if not sel:
-            cmds.warning("Nothing is selected")
+        if not selected:
+            if mode == UV_MODE:
+                cmds.warning("UVs are not selected")
+            else:
+                cmds.warning("Vertices are not selected")
             return
 
-        componentType = sel[0].split(".")[-1][0:3]
-        if not componentType == "map":
-            cmds.warning("UVs are not selected")
+        if not self.targets:
+            cmds.warning("Snap target is not set")
             return
 
-        snapTargetMeshPath = self.LE.text()
+        sourceTree = self.getTargetTree()
+        maxDistance = self.distanceSB.value() or np.inf
+
+        numSnapped = 0
+        numSelected = 0
+
+        # (dag path, vertex indices, old and new object space positions)
+        vertexEdits = []
+
+        for components in selected:
+            indices = components.indices
+            mesh = OpenMaya.MFnMesh(components.dagPath)
 
-        sourceMesh = getMesh(snapTargetMeshPath)
-        sourceTree = createTree(sourceMesh)
+            if mode == UV_MODE:
+                values = getUVs(mesh)
+            else:
+                values = getPoints(mesh)
 
-        sel = OpenMaya.MGlobal.getActiveSelectionList()
-        dagPath = sel.getDagPath(0)
+            _, nearest = sourceTree.query(
+                values[indices], distanceUpperBound=maxDistance)
+            found = nearest < len(sourceTree)
+            values[indices[found]] = sourceTree.points[nearest[found]]
 
-        mesh = OpenMaya.MFnMesh(dagPath)
-        uArray, vArray = mesh.getUVs()
+            if mode == UV_MODE:
+                mesh.setUVs(values[:, 0].tolist(), values[:, 1].tolist())
+            elif found.any():
+                dagPath = OpenMaya.MDagPath(components.dagPath)
+                vertexIds = indices[found]
+                vertexEdits.append((
+                    dagPath,
+                    vertexIds,
+                    getPoints(mesh, OpenMaya.MSpace.kObject)[vertexIds],
+                    toObjectSpace(values[vertexIds], dagPath)))
 
-        sel = cmds.ls(sl=True, fl=True, long=True)
+            numSnapped += np.count_nonzero(found)
+            numSelected += len(indices)
 
-        for i in sel:
-            index = int(re.findall(r'\d+', i)[-1])
-            uv = cmds.polyEditUV(i, q=True)
-            nn = sourceTree.search_nn(uv)
-            data = nn[0].data
-            uArray[index] = data[0]
-            vArray[index] = data[1]
+        if vertexEdits:
+            moveVertices(vertexEdits)
 
-        mesh.setUVs(uArray, vArray)
+        print("Snapped {} of {}".format(numSnapped, numSelected))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+""" Headless texel density normalizer
+
+Normalizes every uv shell of a list of meshes to a reference texel ratio
+without the Window. Works on meshes in a maya session (mayapy) or on mesh
+data exported with meshData.MeshData.save(), which is processed in
+parallel with a process pool and does not need maya at all.
+
+Usage:
+    mayapy -m uvResizer.batch --ratio 0.01 --scene asset.ma --save
+    python -m uvResizer.batch --reference ref.npz --list meshes.txt -o out
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from . import meshArea
+from . import meshData
+from . import uvTransform
+from . import workerPool
+from .meshData import OpenMaya
+
+
+EXPORTED_EXT = ".npz"
+
+
+def normalizeMeshData(data, sourceRatio, keepLayout=False):
+    # type: (meshData.MeshData, float, bool) -> int
+    """ Normalize all uv shells of a mesh, same math as UVObject.scaleShells
+        Args:
+            data: MeshData, u/v arrays are updated
+            sourceRatio: target ratio between uv area and polygon area
+            keepLayout: keep relative positions to each uv shell
+
+        Returns:
+            Number of scaled shells
+    """
+
+    numShells, shellIds = data.getUvShellIds()
+    polyAreas, uvAreas = meshArea.shellAreas(data, shellIds, numShells)
+
+    # Same precision as the MFloatArray the interactive tool writes
+    uArray = data.uArray.astype(np.float32)
+    vArray = data.vArray.astype(np.float32)
+
+    selected = np.flatnonzero((uvAreas > 0) & (polyAreas > 0))
+    uvTransform.normalizeShells(
+        uArray,
+        vArray,
+        shellIds,
+        numShells,
+        uvAreas,
+        polyAreas,
+        sourceRatio,
+        selected,
+        keepLayout)
+
+    data.uArray = uArray.astype(np.float64)
+    data.vArray = vArray.astype(np.float64)
+
+    return len(selected)
+
+
+def getSpace(space):
+    # type: (str) -> OpenMaya.MSpace
+    if space == 'world':
+        return OpenMaya.MSpace.kWorld
+    elif space == 'local':
+        return OpenMaya.MSpace.kObject
+    raise ValueError("wrong space: {}".format(space))
+
+
+def getReferenceRatio(reference, space='world'):
+    # type: (str, str) -> float
+    """ Texel ratio of a reference mesh
+        Args:
+            reference: mesh path or exported mesh file
+            space: 'world' or 'local', ignored for exported files
+
+        Returns:
+            ratio value in float
+    """
+
+    if reference.endswith(EXPORTED_EXT):
+        data = meshData.MeshData.load(reference)
+    else:
+        data = meshData.MeshData.fromPath(reference, getSpace(space))
+
+    return meshArea.texelRatio(data)
+
+
+def normalizeMeshes(paths, sourceRatio, keepLayout=False, space='world'):
+    # type: (list, float, bool, str) -> dict
+    """ Normalize meshes in the current maya session
+        Args:
+            paths: mesh paths
+            sourceRatio: target ratio between uv area and polygon area
+            keepLayout: keep relative positions to each uv shell
+            space: 'world' or 'local'
+
+        Returns:
+            Number of scaled shells per mesh
+    """
+
+    result = {}
+
+    for path in paths:
+        data = meshData.MeshData.fromPath(path, getSpace(space), shells=True)
+        result[path] = normalizeMeshData(data, sourceRatio, keepLayout)
+
+        fnMesh = OpenMaya.MFnMesh(
+            OpenMaya.MSelectionList().add(path).getDagPath(0))
+        fnMesh.setUVs(data.uArray.tolist(), data.vArray.tolist())
+        fnMesh.updateSurface()
+
+    return result
+
+
+def exportMeshes(paths, outputDir, space='world'):
+    # type: (list, str, str) -> list
+    """ Export meshes so they can be normalized without maya
+        Args:
+            paths: mesh paths
+            outputDir: directory for the exported files
+            space: 'world' or 'local'
+
+        Returns:
+            Exported file paths
+    """
+
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    files = []
+
+    for path in paths:
+        data = meshData.MeshData.fromPath(path, getSpace(space), shells=True)
+        fileName = path.strip("|").replace("|", "__").replace(":", "_")
+        filePath = os.path.join(outputDir, fileName + EXPORTED_EXT)
+        data.save(filePath)
+        files.append(filePath)
+
+    return files
+
+
+def _normalizeFile(job):
+    inputPath, outputPath, sourceRatio, keepLayout = job
+    data = meshData.MeshData.load(inputPath)
+    numShells = normalizeMeshData(data, sourceRatio, keepLayout)
+    data.save(outputPath)
+    return inputPath, numShells
+
+
+def normalizeFiles(files, sourceRatio, keepLayout=False, outputDir=None, processes=None):
+    # type: (list, float, bool, str, int) -> dict
+    """ Normalize exported mesh files with a process pool
+        Args:
+            files: exported mesh files
+            sourceRatio: target ratio between uv area and polygon area
+            keepLayout: keep relative positions to each uv shell
+            outputDir: write results here, overwrite the inputs if None
+            processes: number of worker processes, cpu count if None.
+                       Runs in this process if no mayapy is found.
+
+        Returns:
+            Number of scaled shells per file
+    """
+
+    if outputDir is not None and not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    jobs = []
+    for i in files:
+        if outputDir is None:
+            outputPath = i
+        else:
+            outputPath = os.path.join(outputDir, os.path.basename(i))
+        jobs.append((i, outputPath, sourceRatio, keepLayout))
+
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = workerPool.getPool(processes)
+
+    if pool is None:
+        return dict(map(_normalizeFile, jobs))
+
+    try:
+        return dict(pool.imap_unordered(_normalizeFile, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def readMeshList(path):
+    # type: (str) -> list
+    """ Read mesh paths or files, one per line. '#' starts a comment """
+
+    with open(path) as f:
+        lines = [i.split("#", 1)[0].strip() for i in f]
+
+    return [i for i in lines if i]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Normalize the texel density of every uv shell")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--ratio", type=float, help="reference texel ratio")
+    group.add_argument(
+        "--reference", help="reference mesh path or exported mesh file")
+    parser.add_argument(
+        "meshes", nargs="*", help="mesh paths or exported mesh files")
+    parser.add_argument("--list", help="file with one mesh per line")
+    parser.add_argument("--keep-layout", action="store_true")
+    parser.add_argument(
+        "--space", choices=("world", "local"), default="world")
+    parser.add_argument(
+        "-o", "--output", help="output directory for exported mesh files")
+    parser.add_argument("-p", "--processes", type=int, default=None)
+    parser.add_argument("--scene", help="maya scene to open (mayapy)")
+    parser.add_argument(
+        "--save", action="store_true", help="save the scene afterwards")
+    args = parser.parse_args(argv)
+
+    meshes = list(args.meshes)
+    if args.list:
+        meshes.extend(readMeshList(args.list))
+
+    t = time.time()
+
+    if args.scene:
+        import maya.standalone
+        maya.standalone.initialize()
+        from maya import cmds
+        cmds.file(args.scene, open=True, force=True)
+
+    if args.ratio is not None:
+        sourceRatio = args.ratio
+    else:
+        sourceRatio = getReferenceRatio(args.reference, args.space)
+
+    files = [i for i in meshes if i.endswith(EXPORTED_EXT)]
+    paths = [i for i in meshes if not i.endswith(EXPORTED_EXT)]
+
+    if args.scene and not meshes:
+        from maya import cmds
+        paths = cmds.ls(type="mesh", noIntermediate=True, long=True) or []
+
+    result = {}
+
+    if files:
+        result.update(normalizeFiles(
+            files, sourceRatio, args.keep_layout, args.output, args.processes))
+
+    if paths:
+        if OpenMaya is None:
+            parser.error("mesh paths need maya, use mayapy or exported files")
+        result.update(normalizeMeshes(
+            paths, sourceRatio, args.keep_layout, args.space))
+
+    if args.scene and args.save:
+        from maya import cmds
+        cmds.file(save=True, force=True)
+
+    for name in sorted(result):
+        print("{}: {} shells".format(name, result[name]))
+    print("Normalized {} meshes in {:.2f}s".format(
+        len(result), time.time() - t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+""" Batched polygon and uv area computation on MeshData arrays """
+
+import numpy as np
+
+
+def triangleAreas(points, corners):
+    # type: (np.ndarray, np.ndarray) -> np.ndarray
+    """ Area of 3d triangles
+        Args:
+            points: (N, 3) positions
+            corners: (T, 3) indices into points
+
+        Returns:
+            (T,) areas
+    """
+
+    a = points[corners[:, 0]]
+    b = points[corners[:, 1]]
+    c = points[corners[:, 2]]
+    cross = np.cross(b - a, c - a)
+    return 0.5 * np.sqrt(np.einsum("ij,ij->i", cross, cross))
+
+
+def uvTriangleAreas(uArray, vArray, corners, signed=False):
+    # type: (np.ndarray, np.ndarray, np.ndarray, bool) -> np.ndarray
+    """ Area of uv triangles
+        Args:
+            uArray: u values
+            vArray: v values
+            corners: (T, 3) uv indices
+            signed: keep the sign, negative for clockwise triangles
+
+        Returns:
+            (T,) areas
+    """
+
+    au = uArray[corners[:, 0]]
+    av = vArray[corners[:, 0]]
+    bu = uArray[corners[:, 1]] - au
+    bv = vArray[corners[:, 1]] - av
+    cu = uArray[corners[:, 2]] - au
+    cv = vArray[corners[:, 2]] - av
+    areas = 0.5 * (bu * cv - bv * cu)
+
+    if signed:
+        return areas
+    return np.abs(areas)
+
+
+def faceAreas(meshData):
+    # type: (MeshData) -> tuple
+    """ Polygon and uv area of every face in one shot
+        Args:
+            meshData: MeshData
+
+        Returns:
+            (polygon areas, uv areas) per face
+    """
+
+    triangleFaces, corners = meshData.triangleCorners()
+    numFaces = meshData.numFaces
+
+    vertexCorners = meshData.polygonConnects[corners]
+    polyAreas = np.bincount(
+        triangleFaces,
+        weights=triangleAreas(meshData.points, vertexCorners),
+        minlength=numFaces)
+
+    uvCorners = meshData.faceVertexUVs[corners]
+    mapped = np.all(uvCorners >= 0, axis=1)
+    uvAreas = np.bincount(
+        triangleFaces[mapped],
+        weights=uvTriangleAreas(
+            meshData.uArray, meshData.vArray, uvCorners[mapped]),
+        minlength=numFaces)
+
+    return polyAreas, uvAreas
+
+
+def faceShellIds(meshData, uvShellIds):
+    # type: (MeshData, np.ndarray) -> np.ndarray
+    """ UV shell id of every face, -1 for faces without uvs
+        Args:
+            meshData: MeshData
+            uvShellIds: shell id per uv
+
+        Returns:
+            (F,) shell ids
+    """
+
+    shellIds = np.full(meshData.numFaces, -1, dtype=np.int64)
+    firstUVs = meshData.faceVertexUVs[meshData.faceOffsets[:-1]]
+    mapped = (meshData.polygonCounts > 0) & (firstUVs >= 0)
+    shellIds[mapped] = uvShellIds[firstUVs[mapped]]
+    return shellIds
+
+
+def groupSums(values, groupIds, numGroups):
+    # type: (np.ndarray, np.ndarray, int) -> np.ndarray
+    """ Sum values per group, negative group ids are ignored
+        Args:
+            values: (N,) values
+            groupIds: (N,) group index for each value
+            numGroups: number of groups
+
+        Returns:
+            (numGroups,) sums
+    """
+
+    valid = groupIds >= 0
+    return np.bincount(
+        groupIds[valid], weights=values[valid], minlength=numGroups)
+
+
+def shellAreas(meshData, uvShellIds, numShells):
+    # type: (MeshData, np.ndarray, int) -> tuple
+    """ Polygon and uv area summed per uv shell
+        Args:
+            meshData: MeshData
+            uvShellIds: shell id per uv
+            numShells: number of uv shells
+
+        Returns:
+            (polygon areas, uv areas) per shell
+    """
+
+    polyAreas, uvAreas = faceAreas(meshData)
+    shellIds = faceShellIds(meshData, uvShellIds)
+    return (groupSums(polyAreas, shellIds, numShells),
+            groupSums(uvAreas, shellIds, numShells))
+
+
+def texelRatio(meshData):
+    # type: (MeshData) -> float
+    """ Ratio between the uv area and the polygon area of a whole mesh
+        Args:
+            meshData: MeshData
+
+        Returns:
+            ratio value in float
+    """
+
+    polyAreas, uvAreas = faceAreas(meshData)
+    return float(uvAreas.sum() / polyAreas.sum())
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+""" Bulk mesh arrays for the numpy based uv tools.
+
+Everything maya related is pulled out of the mesh in a few bulk api calls
+so the math can be done on plain numpy arrays.
+"""
+
+import numpy as np
+
+try:
+    from maya.api import OpenMaya
+except ImportError:
+    # Exported mesh data can be processed outside of maya
+    OpenMaya = None
+
+
+def toArray(mArray, dtype):
+    """ Copy a maya api array into a numpy array
+        Args:
+            mArray: MIntArray, MFloatArray etc.
+            dtype: numpy dtype
+
+        Returns:
+            numpy array
+    """
+
+    return np.fromiter(mArray, dtype=dtype, count=len(mArray))
+
+
+def toPointArray(mPointArray):
+    """ Copy a MPointArray into a (N, 3) numpy array
+        Args:
+            mPointArray: MPointArray
+
+        Returns:
+            numpy array
+    """
+
+    if len(mPointArray) == 0:
+        return np.zeros((0, 3), dtype=np.float64)
+
+    return np.array(mPointArray, dtype=np.float64)[:, :3]
+
+
+class MeshData(object):
+    """ Topology, positions and uvs of a single mesh as numpy arrays
+
+        Face-vertices are stored in maya's order, face f owns
+        polygonConnects[faceOffsets[f]:faceOffsets[f + 1]].
+    """
+
+    def __init__(self,
+                 points,
+                 polygonCounts,
+                 polygonConnects,
+                 uArray,
+                 vArray,
+                 uvCounts,
+                 uvIds,
+                 triangleCounts=None,
+                 triangleVertices=None,
+                 uvShellIds=None,
+                 name=""):
+        # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, str) -> None
+
+        self.name = name
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.polygonCounts = np.asarray(polygonCounts, dtype=np.int64)
+        self.polygonConnects = np.asarray(polygonConnects, dtype=np.int64)
+        self.uArray = np.asarray(uArray, dtype=np.float64)
+        self.vArray = np.asarray(vArray, dtype=np.float64)
+        self.uvCounts = np.asarray(uvCounts, dtype=np.int64)
+        self.uvIds = np.asarray(uvIds, dtype=np.int64)
+
+        if triangleCounts is not None:
+            triangleCounts = np.asarray(triangleCounts, dtype=np.int64)
+            triangleVertices = np.asarray(triangleVertices, dtype=np.int64)
+        self.triangleCounts = triangleCounts
+        self.triangleVertices = triangleVertices
+
+        if uvShellIds is not None:
+            uvShellIds = np.asarray(uvShellIds, dtype=np.int64)
+        self.uvShellIds = uvShellIds
+
+        self.faceOffsets = np.zeros(len(self.polygonCounts) + 1, dtype=np.int64)
+        np.cumsum(self.polygonCounts, out=self.faceOffsets[1:])
+
+        # UV id for each face-vertex, -1 for faces without uvs
+        self.faceVertexUVs = np.full(len(self.polygonConnects), -1, dtype=np.int64)
+        hasUVs = np.repeat(self.uvCounts > 0, self.polygonCounts)
+        self.faceVertexUVs[hasUVs] = self.uvIds
+
+    @classmethod
+    def fromDagPath(cls, dagPath, space=None, uvSet=None, shells=False):
+        # type: (OpenMaya.MDagPath, OpenMaya.MSpace, str, bool) -> MeshData
+        """ Pull all arrays out of a mesh with bulk api calls
+            Args:
+                dagPath: mesh dag path
+                space: MSpace for the point positions, world by default
+                uvSet: uv set name, current uv set by default
+                shells: also query uv shell ids
+
+            Returns:
+                MeshData
+        """
+
+        if space is None:
+            space = OpenMaya.MSpace.kWorld
+
+        uvSetArgs = (uvSet,) if uvSet else ()
+
+        mesh = OpenMaya.MFnMesh(dagPath)
+        polygonCounts, polygonConnects = mesh.getVertices()
+        uArray, vArray = mesh.getUVs(*uvSetArgs)
+        uvCounts, uvIds = mesh.getAssignedUVs(*uvSetArgs)
+        triangleCounts, triangleVertices = mesh.getTriangles()
+
+        uvShellIds = None
+        if shells:
+            _, shellIds = mesh.getUvShellsIds(*uvSetArgs)
+            uvShellIds = toArray(shellIds, np.int64)
+
+        return cls(
+            toPointArray(mesh.getPoints(space)),
+            toArray(polygonCounts, np.int64),
+            toArray(polygonConnects, np.int64),
+            toArray(uArray, np.float64),
+            toArray(vArray, np.float64),
+            toArray(uvCounts, np.int64),
+            toArray(uvIds, np.int64),
+            toArray(triangleCounts, np.int64),
+            toArray(triangleVertices, np.int64),
+            uvShellIds,
+            dagPath.fullPathName())
+
+    @classmethod
+    def fromPath(cls, path, space=None, uvSet=None, shells=False):
+        # type: (str, OpenMaya.MSpace, str, bool) -> MeshData
+        """ Same as fromDagPath but takes a node name """
+
+        sel = OpenMaya.MSelectionList()
+        sel.add(path)
+        return cls.fromDagPath(sel.getDagPath(0), space, uvSet, shells)
+
+    @classmethod
+    def load(cls, path):
+        # type: (str) -> MeshData
+        """ Load mesh data exported with save()
+            Args:
+                path: .npz file path
+
+            Returns:
+                MeshData
+        """
+
+        with np.load(path) as data:
+            def optional(key):
+                return data[key] if key in data.files else None
+
+            return cls(
+                data["points"],
+                data["polygonCounts"],
+                data["polygonConnects"],
+                data["uArray"],
+                data["vArray"],
+                data["uvCounts"],
+                data["uvIds"],
+                optional("triangleCounts"),
+                optional("triangleVertices"),
+                optional("uvShellIds"),
+                str(data["name"]) if "name" in data.files else "")
+
+    def save(self, path):
+        # type: (str) -> None
+        """ Save mesh data so it can be processed without maya
+            Args:
+                path: .npz file path
+
+            Returns:
+                None
+        """
+
+        arrays = {
+            "name": np.array(self.name),
+            "points": self.points,
+            "polygonCounts": self.polygonCounts,
+            "polygonConnects": self.polygonConnects,
+            "uArray": self.uArray,
+            "vArray": self.vArray,
+            "uvCounts": self.uvCounts,
+            "uvIds": self.uvIds}
+
+        if self.triangleCounts is not None:
+            arrays["triangleCounts"] = self.triangleCounts
+            arrays["triangleVertices"] = self.triangleVertices
+        if self.uvShellIds is not None:
+            arrays["uvShellIds"] = self.uvShellIds
+
+        np.savez_compressed(path, **arrays)
+
+    @property
+    def numFaces(self):
+        return len(self.polygonCounts)
+
+    @property
+    def numUVs(self):
+        return len(self.uArray)
+
+    def getUvShellIds(self):
+        # type: () -> tuple
+        """ UV shell id of every uv
+
+            Uses the ids queried from maya when available, otherwise
+            shells are computed as connected components of the uvs that
+            share a face.
+
+            Returns:
+                (number of shells, shell id for each uv)
+        """
+
+        if self.uvShellIds is None:
+            self.uvShellIds = self._computeUvShellIds()
+
+        if self.numUVs == 0:
+            return 0, self.uvShellIds
+
+        return int(self.uvShellIds.max()) + 1, self.uvShellIds
+
+    def _computeUvShellIds(self):
+        # Link every face-vertex uv to the first uv of its face
+        firstCorners = np.repeat(self.faceOffsets[:-1], self.polygonCounts)
+        firstUVs = self.faceVertexUVs[firstCorners]
+        mapped = self.faceVertexUVs >= 0
+        a = firstUVs[mapped]
+        b = self.faceVertexUVs[mapped]
+
+        # Union by hooking the larger label onto the smaller one, then
+        # pointer jumping until every link has the same label on both ends
+        labels = np.arange(self.numUVs, dtype=np.int64)
+        while True:
+            la = labels[a]
+            lb = labels[b]
+            differ = la != lb
+            if not differ.any():
+                break
+            np.minimum.at(
+                labels,
+                np.maximum(la[differ], lb[differ]),
+                np.minimum(la[differ], lb[differ]))
+            while True:
+                jumped = labels[labels]
+                if np.array_equal(jumped, labels):
+                    break
+                labels = jumped
+
+        _, shellIds = np.unique(labels, return_inverse=True)
+        return shellIds.astype(np.int64)
+
+    def triangleCorners(self):
+        # type: () -> tuple
+        """ Triangulation as face-vertex indices
+
+            Uses maya's triangulation when it is available, otherwise
+            polygons are fan triangulated.
+
+            Returns:
+                (face index per triangle, (T, 3) face-vertex indices)
+        """
+
+        if self.triangleCounts is None:
+            return self._fanTriangulation()
+
+        triangleFaces = np.repeat(
+            np.arange(self.numFaces, dtype=np.int64), self.triangleCounts)
+        cornerFaces = np.repeat(triangleFaces, 3)
+
+        # getTriangles returns vertex ids. Find the face-vertex that has
+        # the same vertex in the same face by searching (face, vertex) keys.
+        numVertices = max(len(self.points), 1)
+        fvFaces = np.repeat(
+            np.arange(self.numFaces, dtype=np.int64), self.polygonCounts)
+        keys = fvFaces * numVertices + self.polygonConnects
+        order = np.argsort(keys, kind="stable")
+        query = cornerFaces * numVertices + self.triangleVertices
+        found = np.searchsorted(keys[order], query)
+        found = np.minimum(found, len(order) - 1)
+        corners = order[found].reshape(-1, 3)
+
+        return triangleFaces, corners
+
+    def _fanTriangulation(self):
+        counts = np.maximum(self.polygonCounts - 2, 0)
+        triangleFaces = np.repeat(
+            np.arange(self.numFaces, dtype=np.int64), counts)
+        starts = np.repeat(self.faceOffsets[:-1], counts)
+
+        # Local index of each triangle within its face
+        triangleOffsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=triangleOffsets[1:])
+        local = np.arange(len(triangleFaces), dtype=np.int64) \
+            - np.repeat(triangleOffsets[:-1], counts)
+
+        corners = np.empty((len(triangleFaces), 3), dtype=np.int64)
+        corners[:, 0] = starts
+        corners[:, 1] = starts + local + 1
+        corners[:, 2] = starts + local + 2
+
+        return triangleFaces, corners
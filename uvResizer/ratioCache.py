@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+""" Texel ratio and uv pivot cache for uvResizer
+
+Entries are keyed by mesh identity and dropped by a node dirty callback,
+so repeated clicks on the same reference mesh don't recompute its areas
+while any topology, position or uv edit does.
+"""
+
+from collections import OrderedDict
+
+from maya.api import OpenMaya
+import numpy as np
+
+from . import meshArea
+from . import meshData
+
+
+class CacheEntry(object):
+    __slots__ = ("handle", "callback", "ratios", "bbox")
+
+    def __init__(self, dagPath):
+        # type: (OpenMaya.MDagPath) -> None
+
+        self.handle = OpenMaya.MObjectHandle(dagPath.node())
+
+        # space -> (world matrix, ratio)
+        self.ratios = {}
+
+        # (uMin, uMax, vMin, vMax)
+        self.bbox = None
+
+        # Any edit of the shape dirties it, moving its transform doesn't
+        self.callback = OpenMaya.MNodeMessage.addNodeDirtyCallback(
+            dagPath.node(), self.invalidate)
+
+    def invalidate(self, *args):
+        self.ratios = {}
+        self.bbox = None
+
+    def removeCallback(self):
+        OpenMaya.MMessage.removeCallback(self.callback)
+
+
+def getDagPath(path):
+    # type: (str) -> OpenMaya.MDagPath
+
+    sel = OpenMaya.MSelectionList()
+    sel.add(path)
+    dagPath = sel.getDagPath(0)
+    dagPath.extendToShape()
+    return dagPath
+
+
+class RatioCache(object):
+    """ LRU cache of texel ratios and uv bounding boxes per mesh """
+
+    def __init__(self, maxSize=128):
+        # type: (int) -> None
+
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def clear(self):
+        """ Drop all entries and their callbacks """
+
+        for entry in self._entries.values():
+            entry.removeCallback()
+        self._entries.clear()
+
+    def _getEntry(self, dagPath):
+        # type: (OpenMaya.MDagPath) -> CacheEntry
+
+        handle = OpenMaya.MObjectHandle(dagPath.node())
+        key = (handle.hashCode(), dagPath.fullPathName())
+
+        # Hash codes of deleted nodes can be reused
+        entry = self._entries.get(key)
+        if entry is not None and not (
+                entry.handle.isValid() and entry.handle == handle):
+            entry.removeCallback()
+            entry = None
+
+        if entry is None:
+            entry = CacheEntry(dagPath)
+            self._entries[key] = entry
+
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxSize:
+            _, evicted = self._entries.popitem(last=False)
+            evicted.removeCallback()
+
+        return entry
+
+    def getRatio(self, path, space):
+        # type: (str, str) -> float
+        """ Get ratio between uv area and polygon area
+            Args:
+                path: object fullpath
+                space: 'world' or 'local'
+
+            Returns:
+                ratio value in float
+        """
+
+        if space == 'world':
+            mSpace = OpenMaya.MSpace.kWorld
+        elif space == 'local':
+            mSpace = OpenMaya.MSpace.kObject
+        else:
+            raise ValueError("wrong space: {}".format(space))
+
+        dagPath = getDagPath(path)
+        entry = self._getEntry(dagPath)
+
+        # World space ratios also depend on the transform
+        matrix = None
+        if space == 'world':
+            matrix = tuple(dagPath.inclusiveMatrix())
+
+        cached = entry.ratios.get(space)
+        if cached is not None and cached[0] == matrix:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        ratio = meshArea.texelRatio(meshData.MeshData.fromDagPath(dagPath, mSpace))
+        entry.ratios[space] = (matrix, ratio)
+
+        return ratio
+
+    def getScalePivot(self, paths):
+        # type: (list) -> tuple
+        """ Get scale pivot, the center of the combined uv bounding box
+            Args:
+                paths: List of fullpath strings
+
+            Returns:
+                Scale pivot in uv space
+        """
+
+        bboxes = []
+
+        for path in paths:
+            dagPath = getDagPath(path)
+            entry = self._getEntry(dagPath)
+
+            if entry.bbox is None:
+                self.misses += 1
+                uArray, vArray = OpenMaya.MFnMesh(dagPath).getUVs()
+                if len(uArray) == 0:
+                    continue
+
+                uArray = meshData.toArray(uArray, np.float32)
+                vArray = meshData.toArray(vArray, np.float32)
+                entry.bbox = (
+                    float(uArray.min()),
+                    float(uArray.max()),
+                    float(vArray.min()),
+                    float(vArray.max()))
+            else:
+                self.hits += 1
+
+            bboxes.append(entry.bbox)
+
+        if not bboxes:
+            return (0.0, 0.0)
+
+        bboxes = np.array(bboxes)
+        u = (bboxes[:, 0].min() + bboxes[:, 1].max()) / 2
+        v = (bboxes[:, 2].min() + bboxes[:, 3].max()) / 2
+
+        return (float(u), float(v))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+""" Memory-light undo history for uvResizer
+
+Only the uvs that were modified are stored, as int32 indices with their
+float32 values before and after the edit.
+"""
+
+from collections import deque
+
+from maya.api import OpenMaya
+import numpy as np
+
+from . import meshData
+from . import uvTransform
+
+
+class UVDelta(object):
+    """ UV edit of a single mesh """
+
+    __slots__ = ("dagPath", "indices", "oldU", "oldV", "newU", "newV", "scale")
+
+    def __init__(self, dagPath, indices, oldU, oldV, newU=None, newV=None, scale=None):
+        # type: (OpenMaya.MDagPath, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, tuple) -> None
+        """
+            Args:
+                dagPath: mesh dag path
+                indices: modified uv indices, None if every uv changed
+                oldU: u values before the edit
+                oldV: v values before the edit
+                newU: u values after the edit
+                newV: v values after the edit
+                scale: (pivot u, pivot v, mult) that turns the old values
+                       into the new ones, stored instead of newU/newV
+        """
+
+        self.dagPath = OpenMaya.MDagPath(dagPath)
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int32)
+        self.indices = indices
+        self.oldU = np.asarray(oldU, dtype=np.float32)
+        self.oldV = np.asarray(oldV, dtype=np.float32)
+        if scale is None:
+            newU = np.asarray(newU, dtype=np.float32)
+            newV = np.asarray(newV, dtype=np.float32)
+        self.newU = newU
+        self.newV = newV
+        self.scale = scale
+
+    @property
+    def nbytes(self):
+        size = self.oldU.nbytes + self.oldV.nbytes
+        if self.newU is not None:
+            size += self.newU.nbytes + self.newV.nbytes
+        if self.indices is not None:
+            size += self.indices.nbytes
+        return size
+
+    def _apply(self, uValues, vValues):
+        fnMesh = OpenMaya.MFnMesh(self.dagPath)
+
+        if self.indices is None:
+            uArray = uValues
+            vArray = vValues
+        else:
+            uArray, vArray = fnMesh.getUVs()
+            uArray = meshData.toArray(uArray, np.float32)
+            vArray = meshData.toArray(vArray, np.float32)
+            uArray[self.indices] = uValues
+            vArray[self.indices] = vValues
+
+        fnMesh.setUVs(uArray.tolist(), vArray.tolist())
+        fnMesh.updateSurface()
+
+    def undo(self):
+        self._apply(self.oldU, self.oldV)
+
+    def redo(self):
+        if self.scale is None:
+            self._apply(self.newU, self.newV)
+            return
+
+        pivotU, pivotV, mult = self.scale
+        uValues = self.oldU.copy()
+        vValues = self.oldV.copy()
+        uvTransform.scaleAboutPivot(uValues, vValues, pivotU, pivotV, mult)
+        self._apply(uValues, vValues)
+
+
+class UVHistory(object):
+    """ Multi-level uv edit history with a memory cap
+
+        Every recorded step is a list of UVDelta. When the history grows
+        over maxBytes or maxLevels the oldest steps are dropped and can no
+        longer be undone. The newest step is kept even if it alone is over
+        maxBytes.
+    """
+
+    def __init__(self, maxBytes=256 * 1024 * 1024, maxLevels=50):
+        # type: (int, int) -> None
+
+        self.maxBytes = maxBytes
+        self.maxLevels = maxLevels
+        self.nbytes = 0
+        self._steps = deque()
+
+    def record(self, deltas):
+        # type: (list) -> list
+        """ Add a step to the history
+            Args:
+                deltas: List of UVDelta
+
+            Returns:
+                The recorded step
+        """
+
+        step = list(deltas)
+        size = sum(i.nbytes for i in step)
+        self._steps.append(step)
+        self.nbytes += size
+
+        if size > self.maxBytes:
+            OpenMaya.MGlobal.displayWarning(
+                "uvResizer: undo step of {:.1f} MB is over the history "
+                "limit, older steps are dropped".format(size / 1024.0 / 1024.0))
+
+        # The newest step is always kept
+        while len(self._steps) > 1 and (
+                len(self._steps) > self.maxLevels or
+                self.nbytes > self.maxBytes):
+            dropped = self._steps.popleft()
+            self.nbytes -= sum(i.nbytes for i in dropped)
+
+        return step
+
+    def has(self, step):
+        # type: (list) -> bool
+        return any(i is step for i in self._steps)
+
+    def undo(self, step):
+        # type: (list) -> None
+
+        if not self.has(step):
+            OpenMaya.MGlobal.displayWarning(
+                "uvResizer: undo history was dropped, uvs are not restored")
+            return
+
+        for delta in reversed(step):
+            delta.undo()
+
+    def redo(self, step):
+        # type: (list) -> None
+
+        if not self.has(step):
+            return
+
+        for delta in step:
+            delta.redo()
+
+    def clear(self):
+        self._steps.clear()
+        self.nbytes = 0
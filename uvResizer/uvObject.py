@@ -2,18 +2,41 @@
 
 
 from maya.api import OpenMaya
-import math
+import numpy as np
 import time
 
+try:
+    from .. import componentSelection
+except (ImportError, ValueError):
+    # uvResizer is imported as a top level package
+    import componentSelection
+
+from . import meshArea
+from . import meshData
+from . import uvOverlap
+from . import uvTransform
+
 
 class UVPoint():
-    def __init__(self, u, v, index):
-        # type: (float, float, int) -> None
+    """ Single uv, a view into the shared u/v arrays of a UVObject """
+
+    __slots__ = ("uArray", "vArray", "index")
+
+    def __init__(self, uArray, vArray, index):
+        # type: (np.ndarray, np.ndarray, int) -> None
 
-        self.u = u
-        self.v = v
+        self.uArray = uArray
+        self.vArray = vArray
         self.index = index
 
+    @property
+    def u(self):
+        return float(self.uArray[self.index])
+
+    @property
+    def v(self):
+        return float(self.vArray[self.index])
+
     def __eq__(self, other):
         # type: (UVPoint) -> bool
 
@@ -21,19 +44,19 @@ class UVPoint():
             return self.index == other.index
 
     def __hash__(self):
-        return id(self.index)
+        return hash(self.index)
 
 
 class UVShell():
-    def __init__(self, shellIndex):
-        # type: (int) -> None
+    """ Single uv shell, a view into the shell table of a UVObject """
 
-        self.shellIndex = shellIndex
-        self.points = []
-        self.paths = []
+    __slots__ = ("shellIndex", "uvObject")
 
-        self.polyArea = 0.0
-        self.uvArea = 0.0
+    def __init__(self, shellIndex, uvObject):
+        # type: (int, UVObject) -> None
+
+        self.shellIndex = shellIndex
+        self.uvObject = uvObject
 
     def __eq__(self, other):
         # type: (UVShell) -> bool
@@ -42,23 +65,46 @@ class UVShell():
             return self.shellIndex == other.shellIndex
 
     def __hash__(self):
-        return id(self.shellIndex)
+        return hash(self.shellIndex)
 
-    def getStrings(self):
-        paths = [i.path for i in self.points]
-        return paths
+    @property
+    def indices(self):
+        """ UV indices of this shell, a view into the shell table """
 
-    def getShellPivot(self):
-        u_sum = 0.0
-        v_sum = 0.0
-        for p in self.points:
-            u_sum += p.u
-            v_sum += p.v
+        offsets = self.uvObject.shellOffsets
+        start = offsets[self.shellIndex]
+        end = offsets[self.shellIndex + 1]
+        return self.uvObject.shellUVs[start:end]
+
+    @property
+    def points(self):
+        uArray = self.uvObject.uArray
+        vArray = self.uvObject.vArray
+        return [UVPoint(uArray, vArray, int(i)) for i in self.indices]
+
+    @property
+    def paths(self):
+        return self.getStrings()
+
+    @property
+    def polyArea(self):
+        return float(self.uvObject.polyAreas[self.shellIndex])
 
-        u = u_sum / len(self.points)
-        v = v_sum / len(self.points)
+    @property
+    def uvArea(self):
+        return float(self.uvObject.uvAreas[self.shellIndex])
 
-        return (u, v)
+    def getStrings(self):
+        """ Build uv component paths. Only done on request as this is
+            the most expensive part for large shells
+        """
+
+        path = self.uvObject.dagPath.fullPathName()
+        return ["{}.map[{}]".format(path, i) for i in self.indices]
+
+    def getShellPivot(self):
+        u, v = self.uvObject.pivots[self.shellIndex]
+        return (float(u), float(v))
 
     def has(self, path):
         # type: (str) -> bool
@@ -70,11 +116,20 @@ class UVShell():
                 True if shell has a component
         """
 
-        if path in self.paths:
-            return True
-        else:
+        obj, _, component = path.rpartition(".map[")
+        if obj != self.uvObject.dagPath.fullPathName():
+            return False
+
+        try:
+            index = int(component.rstrip("]"))
+        except ValueError:
+            return False
+
+        if index < 0 or index >= len(self.uvObject.shellIds):
             return False
 
+        return self.uvObject.shellIds[index] == self.shellIndex
+
 
 class UVObject():
     def __init__(self, dagPath, space=OpenMaya.MSpace.kWorld):
@@ -87,42 +142,85 @@ class UVObject():
                 None
         """
 
-        self.shells = []
         self.dagPath = dagPath
 
         t = time.time()
 
-        mesh = OpenMaya.MFnMesh(dagPath)
-        nbUvShells, uvShellIds = mesh.getUvShellsIds()
-
-        # Init UV shell
-        for shellId in range(nbUvShells):
-            shell = UVShell(shellId)
-            for n, j in enumerate(uvShellIds):
-                id = uvShellIds[n]
-                if shellId == id:
-                    path = dagPath.fullPathName() + ".map[{}]".format(n)
-                    u, v = mesh.getUV(n)
-                    p = UVPoint(u, v, n)
-                    shell.points.append(p)
-                    shell.paths.append(path)
-
-            self.shells.append(shell)
-
-        # Init uv and polygon area for each shell
-        polyIter = OpenMaya.MItMeshPolygon(dagPath)
-
-        while not polyIter.isDone():
-            shellId = uvShellIds[polyIter.getUVIndex(0)]
-            shell = self.shells[shellId]
-            polyArea = polyIter.getArea(space)
-            uvArea = polyIter.getUVArea()
-            shell.polyArea += polyArea
-            shell.uvArea += uvArea
-            polyIter.next(None)
+        data = meshData.MeshData.fromDagPath(dagPath, space, shells=True)
+        nbUvShells = int(data.uvShellIds.max()) + 1 if data.numUVs else 0
+
+        # Compact storage, float32 matches MFloatArray precision
+        self.shellIds = data.uvShellIds.astype(np.int32)
+        self.uArray = data.uArray.astype(np.float32)
+        self.vArray = data.vArray.astype(np.float32)
+
+        # Shell table. UV indices grouped by shell id in one pass,
+        # shell i owns shellUVs[shellOffsets[i]:shellOffsets[i + 1]]
+        self.shellUVs, self.shellOffsets = uvTransform.buildShellTable(
+            self.shellIds, nbUvShells)
+        self.pivots = uvTransform.shellPivots(
+            self.uArray, self.vArray, self.shellIds, nbUvShells)
+
+        # Polygon and uv area for each shell
+        self.polyAreas, self.uvAreas = meshArea.shellAreas(
+            data, self.shellIds, nbUvShells)
+
+        # UV triangles for the overlap test, built by getOverlaps
+        self.space = space
+        self.triangleFaces = None
+        self.uvTriangles = None
+
+        self.shells = [UVShell(i, self) for i in range(nbUvShells)]
 
         print(time.time() - t)
 
+    def getPathNames(self):
+        # type: () -> set
+        """ Transform and shape names components of this object can have """
+
+        names = {self.dagPath.fullPathName()}
+        shapePath = OpenMaya.MDagPath(self.dagPath)
+        try:
+            shapePath.extendToShape()
+        except RuntimeError:
+            pass
+        else:
+            names.add(shapePath.fullPathName())
+
+        return names
+
+    def getSelectionMask(self, uvs):
+        # type: (list) -> np.ndarray
+        """ Get selected uvs as a boolean mask
+            Args:
+                uvs: List of uv components in full path strings, ranges
+                     such as '.map[10:200]' are not flattened. A numpy
+                     array of uv indices is accepted as well.
+
+            Returns:
+                Boolean array, one value per uv
+        """
+
+        numUVs = len(self.shellIds)
+
+        if isinstance(uvs, np.ndarray):
+            indices = uvs[(uvs >= 0) & (uvs < numUVs)]
+            mask = np.zeros(numUVs, dtype=bool)
+            mask[indices] = True
+            return mask
+
+        starts, ends = componentSelection.parseComponentRanges(
+            uvs, componentSelection.UV, self.getPathNames())
+
+        # Mark ranges in a difference array instead of expanding them
+        starts = np.clip(starts, 0, numUVs)
+        ends = np.clip(ends + 1, 0, numUVs)
+        delta = np.zeros(numUVs + 1, dtype=np.int64)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, ends, -1)
+
+        return np.cumsum(delta[:-1]) > 0
+
     def getShells(self, uvs):
         # type: (list) -> list
         """Get uv shell objects
@@ -133,18 +231,52 @@ class UVObject():
                 List of uv shell objects
         """
 
-        shellSet = set()
+        selected = self.getSelectionMask(uvs)
+        shellIds = np.unique(self.shellIds[selected])
 
-        for i in uvs:
-            for shell in self.shells:
-                if shell.has(i):
-                    shellSet.add(shell)
-                    break
+        return [self.shells[i] for i in shellIds]
+
+    def getOverlaps(self, shells=None):
+        # type: (list) -> tuple
+        """Find overlapping uv shells
+            Args:
+                shells: List of uv shell objects, only report overlaps
+                        involving these shells. All shells if None
+
+            Returns:
+                ((P, 2) overlapping shell index pairs,
+                 (Q, 2) overlapping face index pairs)
+        """
 
-        return list(shellSet)
+        if self.uvTriangles is None:
+            data = meshData.MeshData.fromDagPath(self.dagPath, self.space)
+            triangleFaces, corners = data.triangleCorners()
+            uvTriangles = data.faceVertexUVs[corners]
+            mapped = np.all(uvTriangles >= 0, axis=1)
+            self.triangleFaces = triangleFaces[mapped].astype(np.int32)
+            self.uvTriangles = uvTriangles[mapped].astype(np.int32)
+
+        shellPairs, trianglePairs = uvOverlap.findOverlaps(
+            self.uArray,
+            self.vArray,
+            self.uvTriangles,
+            self.shellIds[self.uvTriangles[:, 0]],
+            len(self.shells))
+
+        if shells is not None:
+            selected = np.zeros(len(self.shells), dtype=bool)
+            selected[[i.shellIndex for i in shells]] = True
+            shellPairs = shellPairs[np.any(selected[shellPairs], axis=1)]
+            triangleShells = self.shellIds[self.uvTriangles[trianglePairs, 0]]
+            trianglePairs = trianglePairs[np.any(selected[triangleShells], axis=1)]
+
+        facePairs = np.sort(self.triangleFaces[trianglePairs], axis=1)
+        facePairs = np.unique(facePairs, axis=0).reshape(-1, 2)
+
+        return shellPairs, facePairs
 
     def scaleShells(self, shells, sourceRatio, keepLayout=False):
-        # type: (list, float, bool) -> None
+        # type: (list, float, bool) -> np.ndarray
         """Scale uv shells
             Args:
                 shells: List of uv shell objects
@@ -152,38 +284,45 @@ class UVObject():
                 keepLayout: keep relative positions to each uv shell
 
             Returns:
-                None
+                Modified uv indices. uArray/vArray are replaced with the
+                new values, arrays taken before the call keep the old ones.
         """
 
+        shellIds = np.array([i.shellIndex for i in shells], dtype=np.int64)
+
+        degenerate = (self.uvAreas[shellIds] <= 0) | (self.polyAreas[shellIds] <= 0)
+        if degenerate.any():
+            OpenMaya.MGlobal.displayWarning(
+                "{}: skipped {} uv shells without uv or polygon area".format(
+                    self.dagPath.fullPathName(), int(np.count_nonzero(degenerate))))
+            shellIds = shellIds[~degenerate]
+
         fnMesh = OpenMaya.MFnMesh(self.dagPath)
         uArray, vArray = fnMesh.getUVs()
-
-        pivot_u = 0.0
-        pivot_v = 0.0
-
-        if keepLayout:
-            for i in shells:
-                u, v = i.getShellPivot()
-                pivot_u += u
-                pivot_v += v
-            pivot_u = pivot_u / len(shells)
-            pivot_v = pivot_v / len(shells)
-
-        for shell in shells:
-            shellRatio = shell.uvArea / shell.polyArea
-            mult = math.sqrt(sourceRatio / shellRatio)
-            if not keepLayout:
-                pivot_u, pivot_v = shell.getShellPivot()
-
-            for uv in shell.points:
-                u = ((uv.u - pivot_u) * mult) + pivot_u
-                v = ((uv.v - pivot_v) * mult) + pivot_v
-                uArray[uv.index] = u
-                vArray[uv.index] = v
-
-        fnMesh.setUVs(uArray, vArray)
+        uArray = meshData.toArray(uArray, np.float32)
+        vArray = meshData.toArray(vArray, np.float32)
+
+        indices = uvTransform.normalizeShells(
+            uArray,
+            vArray,
+            self.shellIds,
+            len(self.shells),
+            self.uvAreas,
+            self.polyAreas,
+            sourceRatio,
+            shellIds,
+            keepLayout,
+            (self.shellUVs, self.shellOffsets),
+            self.pivots)
+
+        fnMesh.setUVs(uArray.tolist(), vArray.tolist())
         fnMesh.updateSurface()
 
+        self.uArray = uArray
+        self.vArray = vArray
+
+        return indices
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+""" Overlapping uv shell detection
+
+Broad phase: sweep and prune over shell bounding boxes along u.
+Narrow phase: uv triangles of the candidate shell pairs are binned into a
+uniform grid, triangle pairs sharing a cell are tested with the
+separating axis theorem. Shells that only touch along an edge or at a
+point don't overlap.
+"""
+
+import numpy as np
+
+from . import uvTransform
+
+
+# Upper bound of triangle pairs generated at once
+PAIR_BUDGET = 1 << 22
+
+
+def triangleBounds(uArray, vArray, triangles):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """ UV bounding box of every triangle
+        Args:
+            uArray: u values
+            vArray: v values
+            triangles: (T, 3) uv ids
+
+        Returns:
+            (T, 4) uMin, uMax, vMin, vMax
+    """
+
+    u = uArray[triangles]
+    v = vArray[triangles]
+    return np.stack(
+        [u.min(axis=1), u.max(axis=1), v.min(axis=1), v.max(axis=1)], axis=1)
+
+
+def sweepAndPrune(bounds):
+    # type: (np.ndarray) -> np.ndarray
+    """ Pairs of overlapping bounding boxes
+        Args:
+            bounds: (N, 4) uMin, uMax, vMin, vMax
+
+        Returns:
+            (P, 2) index pairs, smaller index first, sorted
+    """
+
+    order = np.argsort(bounds[:, 0], kind="stable")
+    sortedMin = bounds[order, 0]
+
+    # Boxes starting before the u end of a box overlap it in u
+    starts = np.arange(1, len(order) + 1)
+    ends = np.searchsorted(sortedMin, bounds[order, 1], side="left")
+    positions, rangeIds = uvTransform.expandRanges(starts, ends)
+
+    a = order[rangeIds]
+    b = order[positions]
+    overlap = (bounds[a, 2] < bounds[b, 3]) & (bounds[b, 2] < bounds[a, 3])
+
+    pairs = np.stack([a[overlap], b[overlap]], axis=1)
+    pairs.sort(axis=1)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def trianglesOverlap(uArray, vArray, trianglesA, trianglesB, tolerance=1e-9):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, float) -> np.ndarray
+    """ Test triangle pairs for overlapping area
+        Args:
+            uArray: u values
+            vArray: v values
+            trianglesA: (P, 3) uv ids
+            trianglesB: (P, 3) uv ids
+            tolerance: overlaps thinner than this are ignored
+
+        Returns:
+            (P,) boolean mask
+    """
+
+    a = np.stack([uArray[trianglesA], vArray[trianglesA]], axis=2)
+    b = np.stack([uArray[trianglesB], vArray[trianglesB]], axis=2)
+
+    # Edge normals of both triangles are the candidate separating axes
+    edges = np.concatenate(
+        [a[:, [1, 2, 0]] - a, b[:, [1, 2, 0]] - b], axis=1)
+    axes = np.stack([-edges[:, :, 1], edges[:, :, 0]], axis=2)
+    margin = tolerance * np.sqrt(np.einsum("pkd,pkd->pk", axes, axes))
+
+    projA = np.einsum("pkd,pjd->pkj", axes, a)
+    projB = np.einsum("pkd,pjd->pkj", axes, b)
+
+    separated = (projA.max(axis=2) <= projB.min(axis=2) + margin) \
+        | (projB.max(axis=2) <= projA.min(axis=2) + margin)
+
+    return ~np.any(separated, axis=1)
+
+
+def gridPairs(bounds, cellSize):
+    # type: (np.ndarray, float) -> list
+    """ Pairs of boxes that share a grid cell
+        Args:
+            bounds: (N, 4) uMin, uMax, vMin, vMax
+            cellSize: grid cell size
+
+        Returns:
+            List of (P, 2) index pair batches, a pair can show up in
+            several batches when the boxes share more than one cell
+    """
+
+    if len(bounds) == 0:
+        return []
+
+    origin = bounds[:, [0, 2]].min(axis=0)
+    cellMin = np.floor((bounds[:, [0, 2]] - origin) / cellSize).astype(np.int64)
+    cellMax = np.floor((bounds[:, [1, 3]] - origin) / cellSize).astype(np.int64)
+    resolution = int(cellMax[:, 1].max()) + 1
+
+    # One entry per (box, covered cell)
+    spans = cellMax - cellMin + 1
+    counts = spans[:, 0] * spans[:, 1]
+    boxIds = np.repeat(np.arange(len(bounds)), counts)
+    local = np.arange(len(boxIds)) - np.repeat(np.cumsum(counts) - counts, counts)
+    cellU = cellMin[boxIds, 0] + local // spans[boxIds, 1]
+    cellV = cellMin[boxIds, 1] + local % spans[boxIds, 1]
+    keys = cellU * resolution + cellV
+
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    boxIds = boxIds[order]
+
+    # Every entry pairs with the entries after it in the same cell
+    cellEnds = np.searchsorted(keys, keys, side="right")
+    partners = cellEnds - np.arange(len(keys)) - 1
+
+    batches = []
+    batchIds = (np.cumsum(partners) - partners) // PAIR_BUDGET
+    limits = np.concatenate(
+        ([0], np.flatnonzero(np.diff(batchIds)) + 1, [len(keys)]))
+
+    for first, last in zip(limits[:-1], limits[1:]):
+        entries = np.arange(first, last)
+        positions, rangeIds = uvTransform.expandRanges(
+            entries + 1, cellEnds[first:last])
+        batches.append(np.stack(
+            [boxIds[entries[rangeIds]], boxIds[positions]], axis=1))
+
+    return batches
+
+
+def findOverlaps(uArray, vArray, triangles, triangleShells, numShells, tolerance=1e-9):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, int, float) -> tuple
+    """ Find overlapping shells and the triangles that overlap
+        Args:
+            uArray: u values
+            vArray: v values
+            triangles: (T, 3) uv ids
+            triangleShells: (T,) shell id of each triangle
+            numShells: number of shells
+            tolerance: overlaps thinner than this are ignored
+
+        Returns:
+            ((P, 2) overlapping shell pairs, (Q, 2) overlapping triangle pairs)
+    """
+
+    empty = np.zeros((0, 2), dtype=np.int64)
+    if numShells == 0 or len(triangles) == 0:
+        return empty, empty
+
+    # Shell bounds from the triangles so uvs without faces are ignored
+    triBounds = triangleBounds(uArray, vArray, triangles)
+    bounds = np.empty((numShells, 4))
+    bounds[:, [0, 2]] = np.inf
+    bounds[:, [1, 3]] = -np.inf
+    np.minimum.at(bounds[:, 0], triangleShells, triBounds[:, 0])
+    np.maximum.at(bounds[:, 1], triangleShells, triBounds[:, 1])
+    np.minimum.at(bounds[:, 2], triangleShells, triBounds[:, 2])
+    np.maximum.at(bounds[:, 3], triangleShells, triBounds[:, 3])
+
+    shellPairs = sweepAndPrune(bounds[np.isfinite(bounds[:, 0])])
+    shellPairs = np.flatnonzero(np.isfinite(bounds[:, 0]))[shellPairs]
+    if len(shellPairs) == 0:
+        return empty, empty
+
+    # Only triangles of candidate shells take part in the narrow phase
+    candidates = np.zeros(numShells, dtype=bool)
+    candidates[shellPairs.ravel()] = True
+    triangleIds = np.flatnonzero(candidates[triangleShells])
+    candidateBounds = triBounds[triangleIds]
+
+    # Cells about the size of a typical triangle, but no more cells than
+    # a few per triangle over the candidate area
+    extents = np.maximum(
+        candidateBounds[:, 1] - candidateBounds[:, 0],
+        candidateBounds[:, 3] - candidateBounds[:, 2])
+    area = (candidateBounds[:, 1].max() - candidateBounds[:, 0].min()) \
+        * (candidateBounds[:, 3].max() - candidateBounds[:, 2].min())
+    cellSize = max(
+        float(np.median(extents)),
+        float(np.sqrt(area / (4.0 * len(triangleIds)))),
+        1e-12)
+
+    pairKeys = shellPairs[:, 0] * numShells + shellPairs[:, 1]
+    found = []
+
+    for batch in gridPairs(candidateBounds, cellSize):
+        a = triangleIds[batch[:, 0]]
+        b = triangleIds[batch[:, 1]]
+        shellA = triangleShells[a]
+        shellB = triangleShells[b]
+
+        # Different shells that passed the broad phase
+        keys = np.minimum(shellA, shellB) * numShells \
+            + np.maximum(shellA, shellB)
+        keep = (shellA != shellB) & np.isin(keys, pairKeys)
+        a = a[keep]
+        b = b[keep]
+
+        keep = (triBounds[a, 0] < triBounds[b, 1]) \
+            & (triBounds[b, 0] < triBounds[a, 1]) \
+            & (triBounds[a, 2] < triBounds[b, 3]) \
+            & (triBounds[b, 2] < triBounds[a, 3])
+        a = a[keep]
+        b = b[keep]
+
+        keep = trianglesOverlap(
+            uArray, vArray, triangles[a], triangles[b], tolerance)
+        found.append(np.stack([a[keep], b[keep]], axis=1))
+
+    trianglePairs = np.concatenate(found) if found else empty
+    trianglePairs.sort(axis=1)
+    trianglePairs = np.unique(trianglePairs, axis=0)
+
+    shellPairs = np.sort(triangleShells[trianglePairs], axis=1)
+    shellPairs = np.unique(shellPairs, axis=0).reshape(-1, 2)
+
+    return shellPairs, trianglePairs.reshape(-1, 2)
+
+
+def meshOverlaps(meshData, tolerance=1e-9):
+    # type: (MeshData, float) -> tuple
+    """ Overlapping shells and faces of a mesh
+        Args:
+            meshData: MeshData
+            tolerance: overlaps thinner than this are ignored
+
+        Returns:
+            ((P, 2) overlapping shell pairs, (Q, 2) overlapping face pairs)
+    """
+
+    numShells, shellIds = meshData.getUvShellIds()
+    triangleFaces, corners = meshData.triangleCorners()
+
+    uvTriangles = meshData.faceVertexUVs[corners]
+    mapped = np.all(uvTriangles >= 0, axis=1)
+    triangleFaces = triangleFaces[mapped]
+    uvTriangles = uvTriangles[mapped]
+
+    shellPairs, trianglePairs = findOverlaps(
+        meshData.uArray,
+        meshData.vArray,
+        uvTriangles,
+        shellIds[uvTriangles[:, 0]],
+        numShells,
+        tolerance)
+
+    facePairs = np.sort(triangleFaces[trianglePairs], axis=1)
+    facePairs = np.unique(facePairs, axis=0).reshape(-1, 2)
+
+    return shellPairs, facePairs
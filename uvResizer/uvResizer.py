@@ -19,7 +19,21 @@ except ImportError:
 
 import apiundo
 import math
+import numpy as np
+
+try:
+    from .. import componentSelection
+except (ImportError, ValueError):
+    # uvResizer is imported as a top level package
+    import componentSelection
+
+from . import meshArea
+from . import meshData
+from . import ratioCache
+from . import uvHistory
 from . import uvObject
+from . import uvOverlap
+from . import uvTransform
 
 try:
     # For python3
@@ -28,6 +42,13 @@ except ImportError:
     pass
 
 
+reload(componentSelection)
+reload(meshData)
+reload(meshArea)
+reload(uvTransform)
+reload(uvOverlap)
+reload(ratioCache)
+reload(uvHistory)
 reload(uvObject)
 
 
@@ -41,13 +62,6 @@ def getMayaWindow():
     return shiboken.wrapInstance(int(ptr), QtWidgets.QMainWindow)
 
 
-class Mesh(object):
-    def __init__(self, dagPath, uArray, vArray):
-        self.dagPath = dagPath
-        self.uArray = uArray
-        self.vArray = vArray
-
-
 class Window(QtWidgets.QDialog):
 
     def closeExistingWindow(self):
@@ -94,15 +108,23 @@ class Window(QtWidgets.QDialog):
 
         self.setLayout(layout)
 
-        self.history = []
+        # Multi-level undo, only modified uvs are stored
+        self.history = uvHistory.UVHistory()
+
+        # Reference ratios and pivots only change when the meshes do
+        self.cache = ratioCache.RatioCache()
+
+    def closeEvent(self, event):
+        self.cache.clear()
+        super(Window, self).closeEvent(event)
 
     def setObj(self):
         """ Set source object in the UI
         """
 
-        sel = cmds.ls(sl=True, fl=True, long=True)
+        sel = componentSelection.getSelectedObjects()
         if sel:
-            self.le.setText(sel[0])
+            self.le.setText(sel[0].fullPathName())
 
     def scaleUVs(self):
         """ scale UVs
@@ -110,160 +132,149 @@ class Window(QtWidgets.QDialog):
 
         source = self.le.text()
 
-        sel = cmds.ls(sl=True, fl=True, long=True)
+        mSel = OpenMaya.MGlobal.getActiveSelectionList()
 
-        if not sel:
+        if mSel.isEmpty():
             cmds.warning("Nothing is selected")
             return
 
-        if "." in sel[0]:
+        if componentSelection.hasComponents(mSel):
             mode = "components"
         else:
             mode = "object"
 
         if self.spaceCheckBox.isChecked():
-            sourceRatio = getRatio(source, 'world')
+            sourceRatio = self.cache.getRatio(source, 'world')
         else:
-            sourceRatio = getRatio(source, 'local')
+            sourceRatio = self.cache.getRatio(source, 'local')
+
+        deltas = self.doIt(sourceRatio, mode)
+        if not deltas:
+            return
 
-        self.doIt(sourceRatio, mode)
+        step = self.history.record(deltas)
 
-        apiundo.commit(undo=self.undoIt, redo=self.doIt)
+        apiundo.commit(
+            undo=lambda *args: self.history.undo(step),
+            redo=lambda *args: self.history.redo(step))
 
     def doIt(self, sourceRatio, mode):
-        # type: (float, str) -> None
+        # type: (float, str) -> list
         """Run uv scale
 
         Args:
             sourceRatio: source mesh ratio between uv area and obj area
             mode: scale model. 'world' or 'object'
 
+        Returns:
+            List of uvHistory.UVDelta for undo
+
         """
 
         mSel = OpenMaya.MGlobal.getActiveSelectionList()
-        cmdsSel = cmds.ls(sl=True, fl=True, long=True)
+
+        deltas = []
 
         if mode == "object":
-            uCenter, vCenter = getScalePivot(cmdsSel)
+            paths = [mSel.getDagPath(i).fullPathName()
+                     for i in range(mSel.length())]
+            uCenter, vCenter = self.cache.getScalePivot(paths)
 
-            self.history = []
+            if self.spaceCheckBox.isChecked():
+                space = 'world'
+            else:
+                space = 'local'
 
-            # Calculate ratio for all selected
-            ratio_for_all = 0.0
-            for i in cmdsSel:
-                if self.spaceCheckBox.isChecked():
-                    ratio_for_all += getRatio(i, 'world')
-                else:
-                    ratio_for_all += getRatio(i, 'local')
+            # Calculate ratio once per selected object
+            ratios = {}
+            for path in paths:
+                ratios[path] = self.cache.getRatio(path, space)
 
-            ratio_for_all = ratio_for_all / len(cmdsSel)
+            ratio_for_all = sum(ratios.values()) / len(ratios)
             mult_for_all = math.sqrt(sourceRatio / ratio_for_all)
 
             for i in range(mSel.length()):
                 dagPath = mSel.getDagPath(i)
                 mesh = OpenMaya.MFnMesh(dagPath)
                 uArray, vArray = mesh.getUVs()
-                copyUarray = OpenMaya.MFloatArray(uArray)
-                copyVarray = OpenMaya.MFloatArray(vArray)
-
-                # Restore data for undo
-                oldMesh = Mesh(dagPath, copyUarray, copyVarray)
-                self.history.append(oldMesh)
 
                 if self.keepCheckBox.isChecked():
                     mult = mult_for_all
                 else:
                     # Re-calcurate pivot for each object
 
-                    uCenter, vCenter = getScalePivot([dagPath.fullPathName()])
-                    if self.spaceCheckBox.isChecked():
-                        singleRatio = getRatio(dagPath.fullPathName(), 'world')
-                    else:
-                        singleRatio = getRatio(dagPath.fullPathName(), 'local')
+                    uCenter, vCenter = self.cache.getScalePivot(
+                        [dagPath.fullPathName()])
+                    singleRatio = ratios[dagPath.fullPathName()]
 
                     mult = math.sqrt(sourceRatio / singleRatio)
 
-                for j in range(mesh.numUVs()):
-                    u_new = ((uArray[j] - uCenter) * mult) + uCenter
-                    v_new = ((vArray[j] - vCenter) * mult) + vCenter
-                    uArray[j] = u_new
-                    vArray[j] = v_new
+                oldU = meshData.toArray(uArray, np.float32)
+                oldV = meshData.toArray(vArray, np.float32)
+                uValues = oldU.copy()
+                vValues = oldV.copy()
+                uvTransform.scaleAboutPivot(
+                    uValues, vValues, uCenter, vCenter, mult)
 
-                mesh.setUVs(uArray, vArray)
+                mesh.setUVs(uValues.tolist(), vValues.tolist())
                 mesh.updateSurface()
 
+                # Every uv changed by the same scale, store the old values
+                # and the scale instead of indices and new values
+                deltas.append(uvHistory.UVDelta(
+                    dagPath, None, oldU, oldV,
+                    scale=(uCenter, vCenter, mult)))
+
         elif mode == "components":
             print("components selection mode")
-            dagPath = mSel.getDagPath(0)
-            dagPath.pop(1)
-
-            # Restore data for undo
-            mesh = OpenMaya.MFnMesh(dagPath)
-            uArray, vArray = mesh.getUVs()
-            copyUarray = OpenMaya.MFloatArray(uArray)
-            copyVarray = OpenMaya.MFloatArray(vArray)
-            oldMesh = Mesh(dagPath, copyUarray, copyVarray)
-            self.history.append(oldMesh)
-
-            if self.spaceCheckBox.isChecked():
-                uvObj = uvObject.UVObject(dagPath)
-            else:
-                uvObj = uvObject.UVObject(dagPath, OpenMaya.MSpace.kObject)
 
-            selectedShells = uvObj.getShells(cmdsSel)
+            # Selected faces, edges and vertices scale their uv shells too
+            uvSel = componentSelection.convertSelection(
+                componentSelection.UV, mSel)
 
-            if self.keepCheckBox.isChecked():
-                uvObj.scaleShells(selectedShells, sourceRatio, True)
-            else:
-                uvObj.scaleShells(selectedShells, sourceRatio)
-        else:
-            pass
-
-    def undoIt(self, *args):
-        """ Set uv positions back for undo
-        """
-        for i in self.history:
-            fnMesh = OpenMaya.MFnMesh(i.dagPath)
-            fnMesh.setUVs(i.uArray, i.vArray)
-            fnMesh.updateSurface()
+            # Selected uv indices per mesh, never flattened
+            selected = componentSelection.getSelectedComponents(
+                componentSelection.UV, uvSel)
+            if not selected:
+                cmds.warning("Selected components have no UVs")
 
+            for components in selected:
+                dagPath = components.dagPath
 
-def getScalePivot(objs):
-    # type: (list) -> tuple
-    """Get scale pivot
-        Args:
-            objs: List of fullpath strings
-
-        Returns:
-            Scale pivot in uv space
-    """
-
-    xMin = []
-    xMax = []
-    yMin = []
-    yMax = []
+                if self.spaceCheckBox.isChecked():
+                    uvObj = uvObject.UVObject(dagPath)
+                else:
+                    uvObj = uvObject.UVObject(
+                        dagPath, OpenMaya.MSpace.kObject)
 
-    for i in objs:
-        bbox = cmds.polyEvaluate(i, boundingBox2d=True)
-        xMin.append(bbox[0][0])
-        xMax.append(bbox[0][1])
-        yMin.append(bbox[1][0])
-        yMax.append(bbox[1][1])
+                selectedShells = uvObj.getShells(components.indices)
 
-    xMin = min(xMin)
-    xMax = max(xMax)
-    yMin = min(yMin)
-    yMax = max(yMax)
+                oldU = uvObj.uArray
+                oldV = uvObj.vArray
 
-    x = (xMax + xMin) / 2
-    y = (yMax + yMin) / 2
+                if self.keepCheckBox.isChecked():
+                    indices = uvObj.scaleShells(
+                        selectedShells, sourceRatio, True)
+                else:
+                    indices = uvObj.scaleShells(selectedShells, sourceRatio)
+
+                # Only the scaled shells are stored for undo
+                deltas.append(uvHistory.UVDelta(
+                    dagPath,
+                    indices,
+                    oldU[indices],
+                    oldV[indices],
+                    uvObj.uArray[indices],
+                    uvObj.vArray[indices]))
+        else:
+            pass
 
-    return (x, y)
+        return deltas
 
 
 def getRatio(path, space):
     # type: (str, str) -> float
-    """Get scale pivot
+    """Get ratio between uv area and polygon area
         Args:
             path: object fullpath
             space: 'world' or 'local'
@@ -273,31 +284,16 @@ def getRatio(path, space):
 
     """
 
-    polyArea = 0.0
-
     if space == 'world':
-        polyArea = cmds.polyEvaluate(path, worldArea=True)
+        mSpace = OpenMaya.MSpace.kWorld
     elif space == 'local':
-        polyArea = cmds.polyEvaluate(path, area=True)
+        mSpace = OpenMaya.MSpace.kObject
     else:
         cmds.error("wrong space")
 
-    uvArea = 0.0
-
-    sel = OpenMaya.MSelectionList()
-    sel.add(path)
-
-    dagPath = sel.getDagPath(0)
-
-    polyIter = OpenMaya.MItMeshPolygon(dagPath)
-
-    while not polyIter.isDone():
-        uvArea += polyIter.getUVArea()
-        polyIter.next()
-
-    ratio = uvArea / polyArea
+    data = meshData.MeshData.fromPath(path, mSpace)
 
-    return ratio
+    return meshArea.texelRatio(data)
 
 
 def main():
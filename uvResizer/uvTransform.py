@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+""" Vectorized uv transform kernel shared by object and component modes """
+
+import numpy as np
+
+
+def expandRanges(starts, ends):
+    # type: (np.ndarray, np.ndarray) -> tuple
+    """ Expand [start, end) ranges into flat positions
+        Args:
+            starts: range starts
+            ends: exclusive range ends
+
+        Returns:
+            (positions, range index of each position)
+    """
+
+    lengths = np.maximum(ends - starts, 0)
+    rangeIds = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    positions = np.arange(offsets[-1], dtype=np.int64) \
+        - offsets[rangeIds] + starts[rangeIds]
+
+    return positions, rangeIds
+
+
+def buildShellTable(shellIds, numShells):
+    # type: (np.ndarray, int) -> tuple
+    """ Group uv indices by shell id in one pass
+        Args:
+            shellIds: shell id for each uv
+            numShells: number of shells
+
+        Returns:
+            (shellUVs, shellOffsets), shell i owns
+            shellUVs[shellOffsets[i]:shellOffsets[i + 1]]
+    """
+
+    shellUVs = np.argsort(shellIds, kind="stable").astype(np.int32)
+    counts = np.bincount(shellIds, minlength=numShells)
+    shellOffsets = np.zeros(numShells + 1, dtype=np.int32)
+    np.cumsum(counts, out=shellOffsets[1:])
+
+    return shellUVs, shellOffsets
+
+
+def shellPivots(uArray, vArray, shellIds, numShells):
+    # type: (np.ndarray, np.ndarray, np.ndarray, int) -> np.ndarray
+    """ Pivot of each shell as the mean of its uvs
+        Args:
+            uArray: u values
+            vArray: v values
+            shellIds: shell id for each uv
+            numShells: number of shells
+
+        Returns:
+            (numShells, 2) pivots
+    """
+
+    counts = np.maximum(np.bincount(shellIds, minlength=numShells), 1)
+    pivots = np.empty((numShells, 2), dtype=np.float64)
+    pivots[:, 0] = np.bincount(
+        shellIds, weights=uArray, minlength=numShells) / counts
+    pivots[:, 1] = np.bincount(
+        shellIds, weights=vArray, minlength=numShells) / counts
+
+    return pivots
+
+
+def scaleAboutPivot(uArray, vArray, pivotU, pivotV, mult, indices=None):
+    # type: (np.ndarray, np.ndarray, object, object, object, np.ndarray) -> None
+    """ Scale uvs about a pivot in place
+        Args:
+            uArray: u values
+            vArray: v values
+            pivotU: pivot u, scalar or one value per index
+            pivotV: pivot v, scalar or one value per index
+            mult: scale, scalar or one value per index
+            indices: uv indices to scale, all uvs if None
+
+        Returns:
+            None
+    """
+
+    if indices is None:
+        uArray -= pivotU
+        uArray *= mult
+        uArray += pivotU
+        vArray -= pivotV
+        vArray *= mult
+        vArray += pivotV
+        return
+
+    uArray[indices] = (uArray[indices] - pivotU) * mult + pivotU
+    vArray[indices] = (vArray[indices] - pivotV) * mult + pivotV
+
+
+def scaleShells(uArray, vArray, shellUVs, shellOffsets, shellIds, pivots, multipliers):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """ Scale uv shells about their pivots in one broadcast operation
+        Args:
+            uArray: u values, modified in place
+            vArray: v values, modified in place
+            shellUVs: uv indices grouped by shell
+            shellOffsets: shell i owns shellUVs[shellOffsets[i]:shellOffsets[i + 1]]
+            shellIds: shells to scale
+            pivots: (len(shellIds), 2) pivot for each shell
+            multipliers: (len(shellIds),) scale for each shell
+
+        Returns:
+            Modified uv indices
+    """
+
+    shellIds = np.asarray(shellIds, dtype=np.int64)
+    pivots = np.asarray(pivots, dtype=np.float64).reshape(-1, 2)
+    multipliers = np.asarray(multipliers, dtype=np.float64)
+
+    positions, rangeIds = expandRanges(
+        shellOffsets[shellIds].astype(np.int64),
+        shellOffsets[shellIds + 1].astype(np.int64))
+    indices = shellUVs[positions]
+
+    scaleAboutPivot(
+        uArray,
+        vArray,
+        pivots[rangeIds, 0],
+        pivots[rangeIds, 1],
+        multipliers[rangeIds],
+        indices)
+
+    return indices
+
+
+def normalizeShells(uArray, vArray, shellIds, numShells, uvAreas, polyAreas, sourceRatio, selected=None, keepLayout=False, shellTable=None, pivots=None):
+    # type: (np.ndarray, np.ndarray, np.ndarray, int, np.ndarray, np.ndarray, float, np.ndarray, bool, tuple, np.ndarray) -> np.ndarray
+    """ Scale shells so that their texel ratio matches sourceRatio
+        Args:
+            uArray: u values, modified in place
+            vArray: v values, modified in place
+            shellIds: shell id for each uv
+            numShells: number of shells
+            uvAreas: uv area of each shell
+            polyAreas: polygon area of each shell
+            sourceRatio: target ratio between uv area and polygon area
+            selected: shells to scale, all shells if None. Shells without
+                      uv or polygon area are always skipped.
+            keepLayout: scale about the common pivot of the shells
+            shellTable: (shellUVs, shellOffsets) from buildShellTable,
+                        built from shellIds if None
+            pivots: (numShells, 2) pivots from shellPivots, computed if
+                    None. Rows of the scaled shells are updated in place.
+
+        Returns:
+            Modified uv indices
+    """
+
+    if selected is None:
+        selected = np.arange(numShells)
+    selected = np.asarray(selected, dtype=np.int64)
+
+    # A zero area gives an inf/nan multiplier
+    selected = selected[(uvAreas[selected] > 0) & (polyAreas[selected] > 0)]
+
+    if len(selected) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if shellTable is None:
+        shellTable = buildShellTable(shellIds, numShells)
+    shellUVs, shellOffsets = shellTable
+
+    if pivots is None:
+        pivots = shellPivots(uArray, vArray, shellIds, numShells)
+
+    multipliers = shellMultipliers(
+        sourceRatio, uvAreas[selected], polyAreas[selected])
+
+    scalePivots = pivots[selected]
+    if keepLayout:
+        scalePivots = np.broadcast_to(
+            scalePivots.mean(axis=0), scalePivots.shape)
+
+        # Shells move away from the common pivot, their means move too
+        pivots[selected] = (pivots[selected] - scalePivots) \
+            * multipliers[:, np.newaxis] + scalePivots
+
+    return scaleShells(
+        uArray,
+        vArray,
+        shellUVs,
+        shellOffsets,
+        selected,
+        scalePivots,
+        multipliers)
+
+
+def shellMultipliers(sourceRatio, uvAreas, polyAreas):
+    # type: (float, np.ndarray, np.ndarray) -> np.ndarray
+    """ Scale needed for each shell to match a texel ratio
+        Args:
+            sourceRatio: target ratio between uv area and polygon area
+            uvAreas: uv area of each shell
+            polyAreas: polygon area of each shell
+
+        Returns:
+            multiplier for each shell
+    """
+
+    shellRatios = np.asarray(uvAreas, dtype=np.float64) \
+        / np.asarray(polyAreas, dtype=np.float64)
+    return np.sqrt(sourceRatio / shellRatios)
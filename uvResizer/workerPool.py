@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+""" Process pools that are safe to start from maya
+
+Workers are always spawned, never forked, with mayapy or the running
+python interpreter. Forking an initialized maya, or starting another maya
+gui from sys.executable, breaks the workers.
+"""
+
+import multiprocessing
+import os
+import sys
+
+
+def getWorkerExecutable():
+    # type: () -> str
+    """ Python interpreter for pool workers
+        Workers must not start another maya gui, or fork one on linux.
+
+        Returns:
+            The running interpreter, mayapy next to the maya executable,
+            or None if it can't be found
+    """
+
+    name = os.path.basename(sys.executable).lower()
+    if name.startswith(("mayapy", "python")):
+        return sys.executable
+
+    binDir = os.path.dirname(sys.executable)
+    candidates = (
+        # Windows bin/maya.exe, Linux bin/maya.bin
+        os.path.join(binDir, "mayapy.exe"),
+        os.path.join(binDir, "mayapy"),
+        # macOS Maya.app/Contents/MacOS/Maya
+        os.path.join(binDir, os.pardir, "bin", "mayapy"))
+
+    for path in candidates:
+        if os.path.isfile(path):
+            return os.path.normpath(path)
+
+    return None
+
+
+def getPool(processes=None):
+    # type: (int) -> multiprocessing.pool.Pool
+    """ Spawn context pool started with getWorkerExecutable
+        Args:
+            processes: number of worker processes, cpu count if None
+
+        Returns:
+            Pool, or None if no interpreter was found. Run the jobs in
+            this process then.
+    """
+
+    executable = getWorkerExecutable()
+    if executable is None:
+        return None
+
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(executable)
+    return context.Pool(processes)